@@ -1,47 +1,26 @@
-from . import mst_blender
-import bpy
-
 bl_info = {
     "name": "Minimum Spanning Tree (MST)",
     "description": "Addon for creating minimum spanning trees",
     "category": "Add Curve",
     "author": "Patrick Herbers",
-    "blender": (2, 80, 0),
+    "blender": (2, 83, 0),
 }
 
-def menu_draw(self, context):
-    layout = self.layout
-    layout.menu("VIEW3D_MT_minimum_spanning_tree",
-                text="Minimum Spanning Tree",
-                icon="PARTICLES")
+import importlib
 
-class VIEW3D_MT_minimum_spanning_tree(bpy.types.Menu):
-    # Define the "Single Vert" menu
-    bl_idname = "VIEW3D_MT_minimum_spanning_tree"
-    bl_label = "Minimum Spanning Tree"
+# Modules that don't need Blender, they are imported on first access
+_core_modules = ('mstree', 'diameter', 'traversal', 'parallel', 'cache', 'incremental', 'treeio', 'simplify', 'morphometrics', 'tubemesh', 'stats', 'background', 'cli')
 
-    def draw(self, context):
-        layout = self.layout
-        layout.operator_context = 'INVOKE_REGION_WIN'
-        layout.operator("object.add_minimum_spanning_tree")
-        layout.operator("object.add_mst_dendrites")
+def __getattr__(name):
+    if name in _core_modules:
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
 
+# The Blender part is only imported when Blender registers the addon
 def register():
-    registerclasses()
-    # Add menu entry
-    bpy.types.VIEW3D_MT_mesh_add.append(menu_draw)
+    from . import mst_blender
+    mst_blender.register()
 
 def unregister():
-    unregisterclasses()
-    # Remove menu entry
-    bpy.types.VIEW3D_MT_mesh_add.remove(menu_draw)
-
-classes = (
-    mst_blender.OBJECT_OT_dendritedelete,
-    mst_blender.OBJECT_OT_dendriteadd,
-    mst_blender.OBJECT_OT_mstadd,
-    VIEW3D_MT_minimum_spanning_tree
-)
-
-registerclasses, unregisterclasses = bpy.utils.register_classes_factory(classes)
-
+    from . import mst_blender
+    mst_blender.unregister()
@@ -0,0 +1,61 @@
+"""Runs tree computations in a background thread.
+
+Blender's data may only be touched from the main thread, so a modal operator
+gathers the points, lets a BackgroundTask compute the trees and polls it from
+timer events to show the progress and build the geometry once it is done.
+numpy releases the GIL for the array operations of mstree, so the interface
+stays responsive while the task runs.
+"""
+import threading
+
+class Cancelled(Exception):
+	"""Raised inside a task by its progress callback after cancel()"""
+
+class BackgroundTask:
+	"""Calls function(*args, progress = callback, **kwargs) in a daemon thread.
+
+	The function reports its progress by calling callback(done, total). After
+	cancel() the next call of the callback raises Cancelled, which stops the
+	work: the tree loops report every few thousand points, and a process pool
+	polls the callback while waiting, cancels its pending batches and leaves
+	without waiting for the running ones.
+	"""
+	def __init__(self, function, *args, **kwargs):
+		self.progress = (0, 0)
+		self.cancelled = False
+		self._result = None
+		self._error = None
+		self._event = threading.Event()
+		self._thread = threading.Thread(target = self._run, args = (function, args, kwargs), daemon = True)
+
+	def _report(self, done, total):
+		if self.cancelled:
+			raise Cancelled()
+		self.progress = (done, total)
+
+	def _run(self, function, args, kwargs):
+		try:
+			self._result = function(*args, progress = self._report, **kwargs)
+		except BaseException as e:
+			self._error = e
+		finally:
+			self._event.set()
+
+	def start(self):
+		self._thread.start()
+		return self
+
+	def cancel(self):
+		self.cancelled = True
+
+	@property
+	def done(self):
+		return self._event.is_set()
+
+	def result(self, timeout = None):
+		"""Waits for the task and returns its result, or raises its exception"""
+		if not self._event.wait(timeout):
+			raise TimeoutError("Background task is still running")
+		if self._error is not None:
+			raise self._error
+		return self._result
@@ -0,0 +1,96 @@
+"""Cache for computed trees.
+
+Trees are keyed by a hash of the points and the settings mstree uses, so
+changing only output settings like thickness or build type reuses the tree.
+The cache keeps the most recently used trees in memory up to a size limit and
+can additionally store every tree as .npz file in a directory.
+"""
+from . import mstree
+from collections import OrderedDict
+import hashlib
+import copy
+import os
+import numpy as np
+
+def tree_key(points, balancing_factor, engine = 'exhaustive', dtype = np.float64):
+	"""Returns the cache key for the tree mstree computes from these arguments"""
+	points = np.ascontiguousarray(points, dtype = dtype)
+	h = hashlib.sha1()
+	h.update(repr((points.shape, points.dtype.str, float(balancing_factor), engine)).encode())
+	h.update(points.data)
+	return h.hexdigest()
+
+def _tree_bytes(tree):
+	return sum(array.nbytes for array in tree.to_arrays().values())
+
+class TreeCache:
+	"""LRU cache of ArrayTrees bounded by max_bytes, with an optional directory as second tier"""
+	def __init__(self, max_bytes = 256 * 2**20, directory = None):
+		self.max_bytes = max_bytes
+		self.directory = directory
+		self._trees = OrderedDict()
+		self._bytes = 0
+
+	def __len__(self):
+		return len(self._trees)
+
+	def _path(self, key):
+		return os.path.join(self.directory, key + '.npz')
+
+	def get(self, key):
+		"""Returns a copy of the cached tree without thickness, or None.
+
+		The copy shares the arrays of the cached tree, so they must not be modified.
+		"""
+		if key in self._trees:
+			self._trees.move_to_end(key)
+			tree = self._trees[key]
+		elif self.directory and os.path.exists(self._path(key)):
+			with np.load(self._path(key)) as arrays:
+				tree = mstree.ArrayTree.from_arrays(dict(arrays))
+			self._insert(key, tree)
+		else:
+			return None
+
+		tree = copy.copy(tree)
+		tree.thickness = None
+		return tree
+
+	def put(self, key, tree):
+		"""Stores a tree, its thickness is not stored"""
+		tree = copy.copy(tree)
+		tree.thickness = None
+		self._insert(key, tree)
+		if self.directory:
+			os.makedirs(self.directory, exist_ok = True)
+			np.savez(self._path(key), **tree.to_arrays())
+
+	def _insert(self, key, tree):
+		if key in self._trees:
+			self._bytes -= _tree_bytes(self._trees.pop(key))
+		size = _tree_bytes(tree)
+		if size > self.max_bytes:
+			return
+		self._trees[key] = tree
+		self._bytes += size
+		self.evict()
+
+	def evict(self):
+		"""Drops the least recently used trees until the cache fits into max_bytes"""
+		while self._bytes > self.max_bytes:
+			_, tree = self._trees.popitem(last = False)
+			self._bytes -= _tree_bytes(tree)
+
+	def clear(self):
+		"""Drops all trees from memory, the files in directory are kept"""
+		self._trees.clear()
+		self._bytes = 0
+
+	def get_or_build(self, points, balancing_factor = 0.5, engine = 'exhaustive'):
+		"""Returns the cached tree of points or computes and stores it"""
+		key = tree_key(points, balancing_factor, engine)
+		tree = self.get(key)
+		if tree is None:
+			tree = mstree.mstree(points, balancing_factor, engine = engine, compact = True)
+			self.put(key, tree)
+		return tree
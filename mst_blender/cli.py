@@ -0,0 +1,96 @@
+"""Command line batch runner, usable without Blender.
+
+Computes a tree with thickness for every point cloud file in a directory and
+writes the results to an output directory, using a process pool:
+
+	python -m mst_blender points/ trees/ --balancing-factor 0.5 --format swc npz
+"""
+from . import mstree
+from . import diameter
+from . import treeio
+from . import parallel
+from .stats import StageStats
+import argparse
+import time
+import sys
+import os
+
+POINT_EXTENSIONS = ('.npy', '.npz', '.csv', '.txt')
+
+def process_file(path, output_directory, formats = ('swc',), balancing_factor = 0.5, engine = 'grid', thickness = None):
+	"""Computes the tree of one point cloud file and writes it in every format.
+	Returns the number of nodes, the seconds it took and the stage records."""
+	start = time.perf_counter()
+	stats = StageStats()
+	with stats.stage('load') as record:
+		points = treeio.load_points(path)
+		record['points'] = len(points)
+	with stats.stage('mstree', points = len(points)):
+		tree = mstree.mstree(points, balancing_factor, engine = engine, compact = True)
+	if thickness is not None:
+		with stats.stage('diameter', nodes = len(tree)):
+			diameter.add_quad_diameter(tree, **thickness)
+
+	name = os.path.splitext(os.path.basename(path))[0]
+	with stats.stage('write', nodes = len(tree)):
+		if 'swc' in formats:
+			path_scale = thickness.get('path_scale', 1.0) if thickness is not None else 1.0
+			treeio.write_swc(os.path.join(output_directory, name + '.swc'), tree, path_scale = path_scale)
+		if 'npz' in formats:
+			treeio.save_tree(os.path.join(output_directory, name + '.npz'), tree)
+	return len(tree), time.perf_counter() - start, stats.records
+
+def _process_file(path, options):
+	"""Returns the result of process_file, or its exception so one bad file doesn't stop the others"""
+	try:
+		return process_file(path, **options)
+	except Exception as e:
+		return e
+
+def main(argv = None):
+	parser = argparse.ArgumentParser(prog = 'python -m mst_blender', description = 'Compute minimum spanning trees for a directory of point clouds')
+	parser.add_argument('input', help = 'directory with .npy, .npz, .csv or .txt point clouds, the first point is the root')
+	parser.add_argument('output', help = 'directory for the trees')
+	parser.add_argument('--balancing-factor', type = float, default = 0.5)
+	parser.add_argument('--engine', choices = ('exhaustive', 'grid', 'partitioned'), default = 'grid')
+	parser.add_argument('--format', nargs = '+', choices = ('swc', 'npz'), default = ['swc'])
+	parser.add_argument('--no-thickness', action = 'store_true', help = "don't compute the thickness")
+	parser.add_argument('--thickness-scale', type = float, default = 1.0)
+	parser.add_argument('--thickness-offset', type = float, default = 0.5)
+	parser.add_argument('--path-scale', type = float, default = 100.0)
+	parser.add_argument('--processes', type = int, default = 0, help = 'worker processes, 0 uses all cores')
+	parser.add_argument('--stats', metavar = 'FILE', help = 'write the timing of every stage of every file as JSON')
+	args = parser.parse_args(argv)
+
+	paths = sorted(os.path.join(args.input, name) for name in os.listdir(args.input) if name.lower().endswith(POINT_EXTENSIONS))
+	if not paths:
+		print('No point clouds found in %s' % args.input, file = sys.stderr)
+		return 1
+	os.makedirs(args.output, exist_ok = True)
+
+	thickness = None
+	if not args.no_thickness:
+		thickness = {'scale': args.thickness_scale, 'offset': args.thickness_offset, 'path_scale': args.path_scale}
+	options = {'output_directory': args.output, 'formats': args.format,
+		'balancing_factor': args.balancing_factor, 'engine': args.engine, 'thickness': thickness}
+
+	processes = args.processes if args.processes > 0 else os.cpu_count() or 1
+	failures = 0
+	stats = StageStats()
+	results = parallel.completed(_process_file, [(path, options) for path in paths], min(processes, len(paths)))
+	for done, (i, result) in enumerate(results, 1):
+		path = paths[i]
+		if isinstance(result, Exception):
+			failures += 1
+			print('[%d/%d] %s failed: %s' % (done, len(paths), path, result), file = sys.stderr)
+			continue
+		nodes, seconds, records = result
+		for record in records:
+			record['file'] = path
+		stats.records.extend(records)
+		print('[%d/%d] %s: %d nodes in %.2f s' % (done, len(paths), path, nodes, seconds))
+	if args.stats:
+		stats.write(args.stats)
+	if stats.records:
+		print(stats.summary())
+	return 1 if failures else 0
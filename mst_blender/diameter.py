@@ -1,80 +1,103 @@
 from . import mstree
+from . import traversal
+import numpy as np
+
+# For realistic dendrite thickness special quadratic coefficients are needed
+quad_coefficients = \
+{8:  (0.034881,		-0.6837,	3.6564),
+16:  (0.013947,		-0.51179,	4.9629),
+24:  (0.0064104,	-0.39213,	6.0818),
+32:  (0.0040126,	-0.33498,	7.0306),
+40:  (0.0028541,	-0.2992,	7.8229),
+48:  (0.002163,		-0.27289,	8.5377),
+56:  (0.0017122,	-0.25251,	9.1937),
+64:  (0.0013991,	-0.23611,	9.8033),
+72:  (0.0011712,	-0.22255,	10.375),
+80:  (0.0009992,	-0.21109,	10.915),
+88:  (0.00086562,	-0.20124,	11.428),
+96:  (0.00075942,	-0.19265,	11.917),
+104: (0.00067336,	-0.18507,	12.386),
+112: (0.00060242,	-0.17833,	12.837),
+120: (0.00054315,	-0.17227,	13.271),
+128: (0.00049301,	-0.16678,	13.691),
+136: (0.00045017,	-0.16179,	14.097),
+144: (0.00041319,	-0.15722,	14.49),
+152: (0.00038102,	-0.15301,	14.873),
+160: (0.00035283,	-0.14913,	15.245),
+168: (0.00032796,	-0.14552,	15.608),
+176: (0.00030588,	-0.14216,	15.961),
+184: (0.00028618,	-0.13902,	16.306),
+192: (0.0002685,	-0.13608,	16.644),
+200: (0.00025257,	-0.13332,	16.974),
+208: (0.00023817,	-0.13071,	17.297),
+216: (0.00022508,	-0.12825,	17.613),
+224: (0.00021315,	-0.12593,	17.924),
+232: (0.00020224,	-0.12372,	18.228),
+240: (0.00019222,	-0.12162,	18.527),
+248: (0.00018301,	-0.11963,	18.82),
+256: (0.00017452,	-0.11773,	19.109),
+264: (0.00016666,	-0.11591,	19.392),
+272: (0.00015937,	-0.11418,	19.671),
+280: (0.0001526,	-0.11251,	19.946),
+288: (0.00014629,	-0.11092,	20.216),
+296: (0.00014041,	-0.10939,	20.482),
+304: (0.00013491,	-0.10793,	20.744),
+312: (0.00012976,	-0.10651,	21.002),
+320: (0.00012493,	-0.10515,	21.257),
+360: (0.00010472,	-0.099041,	22.48),
+400: (8.9357e-05,	-0.093832,	23.639),
+440: (7.735e-05,	-0.089314,	24.745),
+480: (6.7797e-05,	-0.085364,	25.793),
+520: (6.0049e-05,	-0.081869,	26.789),
+560: (5.3664e-05,	-0.078748,	27.739),
+600: (4.833e-05,	-0.075937,	28.647),
+640: (4.382e-05,	-0.073387,	29.517),
+680: (3.9968e-05,	-0.071061,	30.351),
+720: (3.6647e-05,	-0.068927,	31.152),
+760: (3.3762e-05,	-0.066959,	31.922),
+800: (3.1236e-05,	-0.065137,	32.664),
+840: (2.9011e-05,	-0.063444,	33.378),
+880: (2.704e-05,	-0.061865,	34.067),
+920: (2.5283e-05,	-0.060388,	34.732),
+960: (2.3712e-05,	-0.059003,	35.373)}
+
+_quad_keys = np.array(sorted(quad_coefficients), dtype = float)
+_quad_values = np.array([quad_coefficients[key] for key in sorted(quad_coefficients)])
 
 def add_quad_diameter(root_node, scale = 0.5, offset = 0.5, path_scale = 1.0):
+	"""Sets the thickness of every node, root_node may also be an mstree.ArrayTree.
+
+	The thickness of a node is the mean of the quadratic thickness functions of
+	all terminals in its subtree, evaluated at its own path distance. Since every
+	function is a quadratic in x, the subtree sums of the coefficients are
+	enough to evaluate that mean, and those sums are ranges of a prefix sum over
+	the depth-first order.
+	"""
+	if isinstance(root_node, mstree.ArrayTree):
+		tree = root_node
+	else:
+		tree = mstree.ArrayTree.from_nodes(root_node)
+
+	x = tree.path_distances * path_scale
+	terminals = tree.terminals()
+
+	# Pick the coefficients with the closest key, the lower key wins on ties
+	terminal_x = x[terminals]
+	upper = np.clip(np.searchsorted(_quad_keys, terminal_x), 1, len(_quad_keys) - 1)
+	lower = upper - 1
+	closest = np.where(terminal_x - _quad_keys[lower] <= _quad_keys[upper] - terminal_x, lower, upper)
 
-	# For realistic dendrite thickness special quadratic coefficients are needed
-	quad_coefficients = \
-	{8:  (0.034881,		-0.6837,	3.6564),
-	16:  (0.013947,		-0.51179,	4.9629),
-	24:  (0.0064104,	-0.39213,	6.0818),
-	32:  (0.0040126,	-0.33498,	7.0306),
-	40:  (0.0028541,	-0.2992,	7.8229),
-	48:  (0.002163,		-0.27289,	8.5377),
-	56:  (0.0017122,	-0.25251,	9.1937),
-	64:  (0.0013991,	-0.23611,	9.8033),
-	72:  (0.0011712,	-0.22255,	10.375),
-	80:  (0.0009992,	-0.21109,	10.915),
-	88:  (0.00086562,	-0.20124,	11.428),
-	96:  (0.00075942,	-0.19265,	11.917),
-	104: (0.00067336,	-0.18507,	12.386),
-	112: (0.00060242,	-0.17833,	12.837),
-	120: (0.00054315,	-0.17227,	13.271),
-	128: (0.00049301,	-0.16678,	13.691),
-	136: (0.00045017,	-0.16179,	14.097),
-	144: (0.00041319,	-0.15722,	14.49),
-	152: (0.00038102,	-0.15301,	14.873),
-	160: (0.00035283,	-0.14913,	15.245),
-	168: (0.00032796,	-0.14552,	15.608),
-	176: (0.00030588,	-0.14216,	15.961),
-	184: (0.00028618,	-0.13902,	16.306),
-	192: (0.0002685,	-0.13608,	16.644),
-	200: (0.00025257,	-0.13332,	16.974),
-	208: (0.00023817,	-0.13071,	17.297),
-	216: (0.00022508,	-0.12825,	17.613),
-	224: (0.00021315,	-0.12593,	17.924),
-	232: (0.00020224,	-0.12372,	18.228),
-	240: (0.00019222,	-0.12162,	18.527),
-	248: (0.00018301,	-0.11963,	18.82),
-	256: (0.00017452,	-0.11773,	19.109),
-	264: (0.00016666,	-0.11591,	19.392),
-	272: (0.00015937,	-0.11418,	19.671),
-	280: (0.0001526,	-0.11251,	19.946),
-	288: (0.00014629,	-0.11092,	20.216),
-	296: (0.00014041,	-0.10939,	20.482),
-	304: (0.00013491,	-0.10793,	20.744),
-	312: (0.00012976,	-0.10651,	21.002),
-	320: (0.00012493,	-0.10515,	21.257),
-	360: (0.00010472,	-0.099041,	22.48),
-	400: (8.9357e-05,	-0.093832,	23.639),
-	440: (7.735e-05,	-0.089314,	24.745),
-	480: (6.7797e-05,	-0.085364,	25.793),
-	520: (6.0049e-05,	-0.081869,	26.789),
-	560: (5.3664e-05,	-0.078748,	27.739),
-	600: (4.833e-05,	-0.075937,	28.647),
-	640: (4.382e-05,	-0.073387,	29.517),
-	680: (3.9968e-05,	-0.071061,	30.351),
-	720: (3.6647e-05,	-0.068927,	31.152),
-	760: (3.3762e-05,	-0.066959,	31.922),
-	800: (3.1236e-05,	-0.065137,	32.664),
-	840: (2.9011e-05,	-0.063444,	33.378),
-	880: (2.704e-05,	-0.061865,	34.067),
-	920: (2.5283e-05,	-0.060388,	34.732),
-	960: (2.3712e-05,	-0.059003,	35.373)}
+	# Prefix sums of coefficients and terminal counts in depth-first order
+	position = np.empty(len(tree), dtype = int)
+	position[tree.dfs_order] = np.arange(len(tree))
+	prefix = np.zeros((len(tree) + 1, 4))
+	prefix[position[terminals] + 1, :3] = _quad_values[closest]
+	prefix[position[terminals] + 1, 3] = 1
+	np.cumsum(prefix, axis = 0, out = prefix)
 
-	# Collect all nodes in a list
-	nodes = mstree.tree_to_list(root_node)
-	# Determine terminal nodes
-	terminal_nodes = [node for node in nodes if not node.children]
-	for terminal_node in terminal_nodes:
-		node = terminal_node
-		c = quad_coefficients[min(quad_coefficients, key=lambda x:abs(x - terminal_node.path_distance * path_scale))]
-		while node is not None:
-			x = node.path_distance * path_scale
-			if not hasattr(node, 'temp_t'):
-				node.temp_t = []
-			node.temp_t.append((x**2 * c[0] + x * c[1] + c[2]) * scale)
-			node = node.parent
+	sums = prefix[tree.subtree_ends()] - prefix[position]
+	tree.thickness = (x**2 * sums[:, 0] + x * sums[:, 1] + sums[:, 2]) * scale / sums[:, 3] + offset
 
-	for node in nodes:
-		node.thickness = sum(node.temp_t) / len(node.temp_t) + offset
-		del node.temp_t
+	if tree is not root_node:
+		for node in traversal.pre_order(root_node):
+			node.thickness = tree.thickness[node.index]
@@ -0,0 +1,177 @@
+"""Inserting points into and removing points from an existing tree.
+
+Instead of recomputing the whole tree, only the affected part is repaired:
+
+- An inserted point is attached to the node with the lowest weighted distance
+  |p - node| + balancing_factor * path_distance(node), just like mstree attaches
+  points. Afterwards every node that gets a lower weighted distance through the
+  new point than through its current parent is moved to the new point.
+- When points are removed, their orphaned subtrees are attached again one after
+  another, always the subtree whose root has the lowest weighted distance to the
+  remaining tree first.
+
+The path distances of all moved subtrees are updated. The result is a valid
+tree with the same balancing factor semantics, but not necessarily the exact
+tree mstree would compute for the new points.
+
+Both functions return the indices of the roots of the changed subtrees, i.e.
+nodes that were added, moved or got new path distances, so callers only need
+to rebuild that geometry. Thickness is not kept; call add_quad_diameter on the
+result again, which also changes the thickness of the ancestors of a change.
+"""
+from . import mstree
+import numpy as np
+
+def _ancestor_flags(parents, flags):
+	"""Returns for every node whether it or one of its ancestors is flagged"""
+	flags = flags.copy()
+	pointer = parents.copy()
+	active = np.flatnonzero(pointer >= 0)
+	while len(active):
+		flags[active] |= flags[pointer[active]]
+		pointer[active] = pointer[pointer[active]]
+		active = active[pointer[active] >= 0]
+	return flags
+
+def _update_path_distances(positions, parents, path_distances, nodes):
+	"""Recomputes the path distances of the flagged nodes in place from those of the other nodes"""
+	nodes = np.flatnonzero(nodes)
+	path_distances[nodes] = np.sqrt(np.sum(np.square(positions[nodes] - positions[parents[nodes]]), axis = 1))
+
+	# Pointer jumping, a node is done once it points past the first ancestor that isn't recomputed
+	pointer = np.full(len(parents), -1, dtype = int)
+	pointer[nodes] = parents[nodes]
+	active = nodes
+	while len(active):
+		path_distances[active] = path_distances[active] + path_distances[pointer[active]]
+		pointer[active] = pointer[pointer[active]]
+		active = active[pointer[active] >= 0]
+
+def _weighted_distances(positions, point, path_distances, balancing_factor):
+	"""Weighted distance mstree uses to attach points to nodes"""
+	return np.sqrt(np.sum(np.square(positions - point), axis = 1)) + balancing_factor * path_distances
+
+def _subtree_roots(parents, changed):
+	"""Returns the flagged nodes that have no flagged ancestor"""
+	non_root = parents >= 0
+	has_changed_ancestor = np.zeros(len(parents), dtype = bool)
+	has_changed_ancestor[non_root] = _ancestor_flags(parents, changed)[parents[non_root]]
+	return np.flatnonzero(changed & ~has_changed_ancestor)
+
+def insert_points(tree, points, balancing_factor = 0.5):
+	"""Inserts points into a tree, one after another.
+
+	The new points get the indices len(tree), len(tree) + 1, ... in the given
+	order. Returns the new ArrayTree and the roots of the changed subtrees.
+	"""
+	if not isinstance(tree, mstree.ArrayTree):
+		tree = mstree.ArrayTree.from_nodes(tree)
+
+	points = np.asarray(points, dtype = tree.positions.dtype).reshape(-1, tree.positions.shape[1])
+	length = len(tree)
+	positions = np.concatenate((tree.positions, points))
+	parents = np.concatenate((tree.parents, np.full(len(points), -1, dtype = int)))
+	path_distances = np.concatenate((tree.path_distances, np.zeros(len(points))))
+	changed = np.zeros(len(positions), dtype = bool)
+
+	for index in range(length, len(positions)):
+		point = positions[index]
+		tree_positions = positions[:index]
+		tree_parents = parents[:index]
+
+		# Attach to the node with the lowest weighted distance
+		parent_index = np.argmin(_weighted_distances(tree_positions, point, path_distances[:index], balancing_factor))
+		parents[index] = parent_index
+		path_distances[index] = np.sqrt(np.sum(np.square(point - positions[parent_index]))) + path_distances[parent_index]
+		changed[index] = True
+
+		# Move the nodes that get closer through the new point, its ancestors can't be moved
+		non_root = np.flatnonzero(tree_parents >= 0)
+		current_distance = np.full(index, np.inf)
+		current_distance[non_root] = np.sqrt(np.sum(np.square(tree_positions[non_root] - positions[tree_parents[non_root]]), axis = 1)) \
+			+ balancing_factor * path_distances[tree_parents[non_root]]
+		improved = _weighted_distances(tree_positions, point, path_distances[index], balancing_factor) < current_distance
+		ancestor = parent_index
+		while ancestor >= 0:
+			improved[ancestor] = False
+			ancestor = parents[ancestor]
+
+		if improved.any():
+			parents[:index][improved] = index
+			changed[:index] |= improved
+			moved = np.zeros(index + 1, dtype = bool)
+			moved[:index] = improved
+			_update_path_distances(positions[:index + 1], parents[:index + 1], path_distances[:index + 1], _ancestor_flags(parents[:index + 1], moved))
+
+	order = np.concatenate((tree.dfs_order, np.arange(length, len(positions))))
+	return mstree.ArrayTree(positions, parents, path_distances, order), _subtree_roots(parents, changed)
+
+def remove_points(tree, indices, balancing_factor = 0.5):
+	"""Removes points from a tree, the root can't be removed.
+
+	The remaining points are renumbered in their previous order. Returns the new
+	ArrayTree, the roots of the changed subtrees and an array that maps every
+	old index to its new index, or -1 for removed points.
+	"""
+	if not isinstance(tree, mstree.ArrayTree):
+		tree = mstree.ArrayTree.from_nodes(tree)
+
+	root = tree.dfs_order[0]
+	removed = np.zeros(len(tree), dtype = bool)
+	removed[indices] = True
+	if removed[root]:
+		raise ValueError("The root of a tree can't be removed")
+
+	positions = tree.positions
+	parents = tree.parents.copy()
+	path_distances = tree.path_distances.copy()
+
+	# Cut off the subtrees of the removed points
+	orphans = np.flatnonzero(~removed & (parents >= 0))
+	orphans = orphans[removed[parents[orphans]]]
+	parents[orphans] = -1
+	parents[removed] = -1
+	detached = _ancestor_flags(parents, np.isin(np.arange(len(tree)), orphans))
+	attached = np.flatnonzero(~removed & ~detached)
+
+	# Attach the orphaned subtrees again like mstree attaches points: always the
+	# subtree root with the lowest weighted distance to the attached nodes first
+	best_distance = np.empty(len(orphans))
+	best_parent = np.empty(len(orphans), dtype = int)
+	for i, orphan in enumerate(orphans):
+		weighted_distance = _weighted_distances(positions[attached], positions[orphan], path_distances[attached], balancing_factor)
+		best_parent[i] = attached[np.argmin(weighted_distance)]
+		best_distance[i] = weighted_distance.min()
+
+	pending = np.ones(len(orphans), dtype = bool)
+	for _ in range(len(orphans)):
+		i = np.argmin(np.where(pending, best_distance, np.inf))
+		orphan = orphans[i]
+		pending[i] = False
+		parents[orphan] = best_parent[i]
+
+		subtree = np.zeros(len(tree), dtype = bool)
+		subtree[orphan] = True
+		subtree = _ancestor_flags(parents, subtree) & detached
+		_update_path_distances(positions, parents, path_distances, subtree)
+		detached &= ~subtree
+
+		# The new subtree may be closer to the pending orphans
+		nodes = np.flatnonzero(subtree)
+		for j in np.flatnonzero(pending):
+			weighted_distance = _weighted_distances(positions[nodes], positions[orphans[j]], path_distances[nodes], balancing_factor)
+			k = np.argmin(weighted_distance)
+			if weighted_distance[k] < best_distance[j]:
+				best_distance[j] = weighted_distance[k]
+				best_parent[j] = nodes[k]
+
+	# Renumber the remaining points
+	index_map = np.cumsum(~removed) - 1
+	index_map[removed] = -1
+	keep = ~removed
+	new_parents = np.where(parents[keep] >= 0, index_map[np.maximum(parents[keep], 0)], -1)
+	order = index_map[tree.dfs_order[keep[tree.dfs_order]]]
+	changed = np.zeros(len(tree), dtype = bool)
+	changed[orphans] = True
+	new_tree = mstree.ArrayTree(positions[keep], new_parents, path_distances[keep], order)
+	return new_tree, _subtree_roots(new_parents, changed[keep]), index_map
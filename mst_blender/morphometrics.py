@@ -0,0 +1,186 @@
+"""Morphometric statistics of trees, for comparing generated trees with real dendrites.
+
+Everything is computed with array operations on an mstree.ArrayTree. Values
+that accumulate along the path from the root, like path lengths or the number
+of branch points above a node, are ranges of a prefix sum over the
+depth-first order, as in diameter.add_quad_diameter. Only the Strahler order
+loops, once per centrifugal order of the branch points.
+
+Branch segments are the paths between the root, branch points and tips.
+"""
+from . import mstree
+from . import parallel
+import os
+import numpy as np
+
+def _ancestor_sums(tree, values):
+	"""Returns for every node the sum of values over the node and all its ancestors"""
+	length = len(tree)
+	position = np.empty(length, dtype = int)
+	position[tree.dfs_order] = np.arange(length)
+	difference = np.zeros(length + 1, dtype = np.result_type(values, int))
+	np.add.at(difference, position, values)
+	np.subtract.at(difference, tree.subtree_ends(), values)
+	return np.cumsum(difference[:-1])[position]
+
+def edge_lengths(tree):
+	"""Returns the distance of every node to its parent, 0 for the root"""
+	if not isinstance(tree, mstree.ArrayTree):
+		tree = mstree.ArrayTree.from_nodes(tree)
+	lengths = np.zeros(len(tree))
+	non_root = np.flatnonzero(tree.parents >= 0)
+	lengths[non_root] = np.sqrt(np.sum(np.square(tree.positions[non_root] - tree.positions[tree.parents[non_root]]), axis = 1))
+	return lengths
+
+def path_lengths(tree):
+	"""Returns the length of the path from the root to every node"""
+	if not isinstance(tree, mstree.ArrayTree):
+		tree = mstree.ArrayTree.from_nodes(tree)
+	return _ancestor_sums(tree, edge_lengths(tree))
+
+def branch_points(tree):
+	"""Returns the indices of all nodes with more than one child"""
+	if not isinstance(tree, mstree.ArrayTree):
+		tree = mstree.ArrayTree.from_nodes(tree)
+	return np.flatnonzero(np.diff(tree.child_offsets) > 1)
+
+def centrifugal_order(tree):
+	"""Returns for every node the number of branch points on the path from the root to it, without itself"""
+	if not isinstance(tree, mstree.ArrayTree):
+		tree = mstree.ArrayTree.from_nodes(tree)
+	branching = (np.diff(tree.child_offsets) > 1).astype(int)
+	return _ancestor_sums(tree, branching) - branching
+
+def strahler_order(tree):
+	"""Returns the Strahler order of every node.
+
+	Tips have order 1. A branch point gets the highest order of its children,
+	plus one if more than one child has that order. Nodes with one child have
+	the order of the next branch point or tip below them.
+	"""
+	if not isinstance(tree, mstree.ArrayTree):
+		tree = mstree.ArrayTree.from_nodes(tree)
+	length = len(tree)
+	order = tree.dfs_order
+	child_counts = np.diff(tree.child_offsets)
+	position = np.empty(length, dtype = int)
+	position[order] = np.arange(length)
+
+	# A node with one child is directly followed by it in dfs_order, so the
+	# next node that is not is the branch point or tip below it
+	key_positions = np.where(child_counts[order] != 1, np.arange(length), length)
+	next_key = order[np.minimum.accumulate(key_positions[::-1])[::-1]]
+
+	strahler = np.zeros(length, dtype = int)
+	strahler[child_counts == 0] = 1
+	branches = np.flatnonzero(child_counts > 1)
+	if len(branches):
+		# Branch points only depend on branch points with a higher centrifugal order
+		levels = centrifugal_order(tree)[branches]
+		for level in range(levels.max(), -1, -1):
+			nodes = branches[levels == level]
+			counts = child_counts[nodes]
+			starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+			children = tree.children[np.repeat(tree.child_offsets[nodes] - starts, counts) + np.arange(counts.sum())]
+			child_orders = strahler[next_key[position[children]]]
+			highest = np.maximum.reduceat(child_orders, starts)
+			ties = np.add.reduceat(child_orders == np.repeat(highest, counts), starts)
+			strahler[nodes] = highest + (ties > 1)
+
+	single = np.flatnonzero(child_counts == 1)
+	strahler[single] = strahler[next_key[position[single]]]
+	return strahler
+
+def segments(tree):
+	"""Returns the start and end nodes of all branch segments"""
+	if not isinstance(tree, mstree.ArrayTree):
+		tree = mstree.ArrayTree.from_nodes(tree)
+	length = len(tree)
+	order = tree.dfs_order
+	key = np.diff(tree.child_offsets) != 1
+	key[order[0]] = True
+	key_order = key[order]
+
+	# The nodes between two key nodes form a run in dfs_order, the segment
+	# starts at the parent of the first node of the run
+	run_start = ~key_order & np.concatenate(([True], key_order[:-1]))
+	run_first = np.maximum.accumulate(np.where(run_start, np.arange(length), 0))
+	end_positions = np.flatnonzero(key_order[1:]) + 1
+	ends = order[end_positions]
+	starts = tree.parents[ends]
+	inner = ~key[starts]
+	starts[inner] = tree.parents[order[run_first[end_positions[inner] - 1]]]
+	return starts, ends
+
+def segment_lengths(tree):
+	"""Returns the path length of every branch segment"""
+	if not isinstance(tree, mstree.ArrayTree):
+		tree = mstree.ArrayTree.from_nodes(tree)
+	lengths = path_lengths(tree)
+	starts, ends = segments(tree)
+	return lengths[ends] - lengths[starts]
+
+def branch_angles(tree):
+	"""Returns the angles in radians between the first edges of neighbouring children of every branch point.
+
+	A bifurcation gives one angle, a node with k children k - 1 angles.
+	"""
+	if not isinstance(tree, mstree.ArrayTree):
+		tree = mstree.ArrayTree.from_nodes(tree)
+	first = tree.children[:-1]
+	second = tree.children[1:]
+	pairs = tree.parents[first] == tree.parents[second]
+	first, second = first[pairs], second[pairs]
+	origin = tree.positions[tree.parents[first]]
+	u = tree.positions[first] - origin
+	v = tree.positions[second] - origin
+	norms = np.linalg.norm(u, axis = 1) * np.linalg.norm(v, axis = 1)
+	valid = norms > 0
+	cosine = np.sum(u[valid] * v[valid], axis = 1) / norms[valid]
+	return np.arccos(np.clip(cosine, -1.0, 1.0))
+
+def morphometrics(tree):
+	"""Returns a dict with the statistics of a tree.
+
+	Counts and totals are numbers, distributions are arrays: the path lengths
+	of the tips, the branch segment lengths and the branch angles.
+	"""
+	if not isinstance(tree, mstree.ArrayTree):
+		tree = mstree.ArrayTree.from_nodes(tree)
+	lengths = path_lengths(tree)
+	terminals = tree.terminals()
+	strahler = strahler_order(tree)
+	return {
+		'nodes': len(tree),
+		'tips': len(terminals),
+		'branch_points': len(branch_points(tree)),
+		'cable_length': float(np.sum(edge_lengths(tree))),
+		'max_path_length': float(lengths.max()),
+		'strahler_order': int(strahler[tree.dfs_order[0]]),
+		'max_centrifugal_order': int(centrifugal_order(tree).max()),
+		'path_lengths': lengths[terminals],
+		'segment_lengths': segment_lengths(tree),
+		'branch_angles': branch_angles(tree),
+	}
+
+def _batch(trees):
+	return [morphometrics(tree) for tree in trees]
+
+def batch_morphometrics(trees, processes = None):
+	"""Returns the morphometrics of many trees, computed in a process pool.
+
+	processes defaults to the number of cores, with a single process the
+	statistics are computed in the calling process.
+	"""
+	trees = [tree if isinstance(tree, mstree.ArrayTree) else mstree.ArrayTree.from_nodes(tree) for tree in trees]
+	if processes is None or processes < 1:
+		processes = os.cpu_count() or 1
+	processes = min(processes, len(trees))
+
+	# Larger batches keep the overhead low for many small trees
+	size = max(1, len(trees) // (processes * 4 or 1))
+	starts = range(0, len(trees), size)
+	results = [None] * len(trees)
+	for b, batch in parallel.completed(_batch, [(trees[start:start + size],) for start in starts], processes):
+		results[starts[b]:starts[b] + size] = batch
+	return results
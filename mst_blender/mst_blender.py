@@ -1,25 +1,65 @@
 from . import mstree
 from . import diameter
+from . import cache
+from . import simplify
+from . import tubemesh
+from . import background
+from .stats import StageStats
 import bpy
 import numpy as np
 import mathutils
+import mathutils.bvhtree
 import math
 import random
+import multiprocessing
+import functools
 
 DENDRITE_GROUP_NAME = "DENDRITE_TREES"
 
-def buildTreeMesh(root_node, skin = False):
-    nodes = mstree.tree_to_list(root_node)
-
-    vertices = [node.pos for node in nodes]
-
-    edges = []
-    for i, node in enumerate(nodes):
-        if node.parent is not None:
-            edges.append([i, nodes.index(node.parent)])
-
+# Custom properties of dendrite objects for regenerating only changed trees
+TREE_TAG = "mst_tree"
+TARGET_INDEX = "mst_target"
+TARGET_OBJECT = "mst_target_object"
+TARGET_SYSTEM = "mst_target_particle_system"
+
+# Both engines build the same tree, the grid engine is faster from about this many points
+GRID_ENGINE_POINTS = 8000
+
+# Computed trees, so redoing an operator with different output settings doesn't recompute them
+TREE_CACHE = cache.TreeCache()
+
+def getTreeCache():
+    """Returns the tree cache with the size and directory from the addon preferences"""
+    addon = bpy.context.preferences.addons.get(__package__)
+    if addon is not None:
+        preferences = addon.preferences
+        TREE_CACHE.max_bytes = preferences.cache_size * 2**20
+        TREE_CACHE.directory = bpy.path.abspath(preferences.cache_directory) if preferences.cache_directory else None
+        TREE_CACHE.evict()
+    return TREE_CACHE
+
+def buildTreeMesh(tree, skin = False):
+    if not isinstance(tree, mstree.ArrayTree):
+        tree = mstree.ArrayTree.from_nodes(tree)
+
+    # Vertices are stored in depth-first order, every vertex but the root has an edge to its parent
+    order = tree.dfs_order
+    vertex_index = np.empty(len(order), dtype = np.int32)
+    vertex_index[order] = np.arange(len(order), dtype = np.int32)
+
+    vertices = np.zeros((len(order), 3), dtype = np.float32)
+    vertices[:, :tree.positions.shape[1]] = tree.positions[order]
+
+    edges = np.empty((len(order) - 1, 2), dtype = np.int32)
+    edges[:, 0] = np.arange(1, len(order), dtype = np.int32)
+    edges[:, 1] = vertex_index[tree.parents[order[1:]]]
+
+    # Fill the mesh in bulk instead of going through Python lists
     mesh = bpy.data.meshes.new("Tree")
-    mesh.from_pydata(vertices, edges, [])
+    mesh.vertices.add(len(vertices))
+    mesh.vertices.foreach_set("co", vertices.ravel())
+    mesh.edges.add(len(edges))
+    mesh.edges.foreach_set("vertices", edges.ravel())
     mesh.update()
 
     obj = bpy.data.objects.new("Tree", mesh)
@@ -28,40 +68,45 @@ def buildTreeMesh(root_node, skin = False):
     if skin:
         obj.modifiers.new("DendriteThickness", 'SKIN')
         obj.modifiers["DendriteThickness"].use_smooth_shade = True
-        for i, node in enumerate(nodes):
-            obj.data.skin_vertices[0].data[i].radius= (node.thickness * 0.005, node.thickness * 0.005)
+        radius = np.repeat(tree.thickness[order] * 0.005, 2).astype(np.float32)
+        obj.data.skin_vertices[0].data.foreach_set("radius", radius)
 
     return obj
 
-def buildTreeCurve(root_node):
+def buildTreeCurve(tree, spline_type = 'BEZIER'):
+    if not isinstance(tree, mstree.ArrayTree):
+        tree = mstree.ArrayTree.from_nodes(tree)
+
     curve = bpy.data.curves.new('Tree', 'CURVE')
     curve.dimensions = '3D'
 
-    nodes = mstree.tree_to_list(root_node)
-
-    curve.splines.new('BEZIER')
-    for i, node in enumerate(nodes):
-        spline = curve.splines[-1]
-        spline.bezier_points.add(count=1)
+    # One spline per unbranched path
+    nodes, boundaries = tree.paths()
+
+    coordinates = np.zeros((len(nodes), 4), dtype = np.float32)
+    coordinates[:, :tree.positions.shape[1]] = tree.positions[nodes]
+    coordinates[:, 3] = 1.0
+    if tree.thickness is not None:
+        radius = tree.thickness[nodes].astype(np.float32)
+
+    # Bezier handles are put on the point itself, new points have FREE handles
+    # so this gives straight segments without setting the handle types one by one
+    for start, end in zip(boundaries[:-1].tolist(), boundaries[1:].tolist()):
+        spline = curve.splines.new(spline_type)
+        if spline_type == 'POLY':
+            points = spline.points
+            points.add(count=end - start - 1)
+            points.foreach_set("co", coordinates[start:end].ravel())
+        else:
+            points = spline.bezier_points
+            points.add(count=end - start - 1)
+            co = np.ascontiguousarray(coordinates[start:end, :3]).ravel()
+            points.foreach_set("co", co)
+            points.foreach_set("handle_left", co)
+            points.foreach_set("handle_right", co)
 
-        point = spline.bezier_points[-1]
-        point.co = mathutils.Vector(node.pos)
-        point.handle_left_type = 'VECTOR'
-        point.handle_right_type = 'VECTOR'
-        
-        if hasattr(node, 'thickness'):
-            point.radius = node.thickness
-        
-        if not node.children and len(nodes) > i + 1:
-            node = nodes[i+1].parent
-            curve.splines.new('BEZIER')
-            spline = curve.splines[-1]
-            point = spline.bezier_points[0]
-            point.co = mathutils.Vector(node.pos)
-            point.handle_left_type = 'VECTOR'
-            point.handle_right_type = 'VECTOR'
-            if hasattr(node, 'thickness'):
-                point.radius = node.thickness
+        if tree.thickness is not None:
+            points.foreach_set("radius", radius[start:end])
 
     curve_object = bpy.data.objects.new("Tree", curve)
     bpy.context.scene.collection.objects.link(curve_object)
@@ -69,130 +114,408 @@ def buildTreeCurve(root_node):
     curve.fill_mode = 'FULL'
     return curve_object
 
-def spinPoints(points, axis, axis_direction, radians = math.pi, seed = None):
-    rng = random.Random()
-    rng.seed(seed)
+def buildTreeTube(tree, resolution = 8):
+    """Builds the final tube geometry of a tree as mesh, the thickness sets the tube radius"""
+    if not isinstance(tree, mstree.ArrayTree):
+        tree = mstree.ArrayTree.from_nodes(tree)
 
-    dir_n = axis_direction / np.linalg.norm(axis_direction)
-    a = axis[0]; b = axis[1]; c = axis[2]
-    u = dir_n[0]; v = dir_n[1]; w = dir_n[2]
+    vertices, loop_starts, loop_totals, loops = tubemesh.tube_mesh(tree, resolution, radius = 0.005)
 
-    new_points = []
+    mesh = bpy.data.meshes.new("Tree")
+    mesh.vertices.add(len(vertices))
+    mesh.vertices.foreach_set("co", vertices.astype(np.float32).ravel())
+    mesh.loops.add(len(loops))
+    mesh.loops.foreach_set("vertex_index", loops.astype(np.int32))
+    mesh.polygons.add(len(loop_starts))
+    mesh.polygons.foreach_set("loop_start", loop_starts.astype(np.int32))
+    # Blender 4.0 and later derive the read-only totals from the starts
+    if bpy.app.version < (4, 0, 0):
+        mesh.polygons.foreach_set("loop_total", loop_totals.astype(np.int32))
+    mesh.polygons.foreach_set("use_smooth", np.ones(len(loop_starts), dtype = bool))
+    mesh.update(calc_edges = True)
+
+    obj = bpy.data.objects.new("Tree", mesh)
+    bpy.context.scene.collection.objects.link(obj)
+    return obj
 
-    # Formula: http://inside.mines.edu/fs_home/gmurray/ArbitraryAxisRotation/
-    for point in points:
-        rotation = rng.random() * radians
-        x = point[0]; y = point[1]; z = point[2]
-        v1 = (a*(v**2 + w**2) - u*(b*v + c*w - u*x - v*y - w*z)) * (1 - np.cos(rotation)) + x*np.cos(rotation) + (-c*v + b*w - w*y + v*z) * np.sin(rotation)
-        v2 = (b*(u**2 + w**2) - v*(a*u + c*w - u*x - v*y - w*z)) * (1 - np.cos(rotation)) + y*np.cos(rotation) + ( c*u - a*w + w*x - u*z) * np.sin(rotation)
-        v3 = (c*(u**2 + v**2) - w*(a*u + b*v - u*x - v*y - w*z)) * (1 - np.cos(rotation)) + z*np.cos(rotation) + (-b*u + a*v - v*x + u*y) * np.sin(rotation)
-        new_points.append((v1,v2,v3))
+def spinPoints(points, axis, axis_direction, radians = math.pi, seed = None, legacy_random = False):
+    """Rotates every point by a random angle between 0 and radians around an axis.
+
+    The angles are drawn from a numpy Generator seeded with seed. With
+    legacy_random the angles are drawn one by one from random.Random like in
+    earlier versions, which reproduces the points those versions generated for a seed.
+    """
+    points = np.asarray(points, dtype = float)
+    if legacy_random:
+        rng = random.Random()
+        rng.seed(seed)
+        rotation = np.array([rng.random() for _ in range(len(points))]) * radians
+    else:
+        rotation = np.random.default_rng(seed).random(len(points)) * radians
 
-    return np.array(new_points)
+    # Rodrigues' rotation formula, applied to all points at once
+    k = axis_direction / np.linalg.norm(axis_direction)
+    v = points - axis
+    cos = np.cos(rotation)[:, np.newaxis]
+    sin = np.sin(rotation)[:, np.newaxis]
+    return axis + v * cos + np.cross(k, v) * sin + np.outer(v @ k, k) * (1 - cos)
 
-def createTreeObject(options = None):
+def gatherPoints(options = None, stats = None):
+    """Returns the points of a tree relative to its root, and the root location"""
     if options is None:
         options = bpy.context.scene.mst_options
+    if stats is None:
+        stats = StageStats()
+
+    with stats.stage('gather') as record:
+        points, root_point, seed = harvestPoints(options)
+        record['points'] = len(points)
+
+    # Spin points randomly on an axis if enabled
+    if options.random_spin:
+        with stats.stage('spin', points = len(points)):
+            if options.spin_axis == 'Y':
+                up_axis = mathutils.Vector((0.0, 1.0, 0.0))
+            elif options.spin_axis == 'Z':
+                up_axis = mathutils.Vector((0.0, 0.0, 1.0))
+            else:
+                up_axis = mathutils.Vector((1.0, 0.0, 0.0))
+
+            axis = bpy.data.objects[options.spin_object].rotation_euler.to_matrix() @ up_axis
+            location = bpy.data.objects[options.spin_object].location - mathutils.Vector(root_point)
+
+            points = spinPoints(points, np.array(location), np.array(axis), options.spin_degrees, seed, options.legacy_spin)
+
+    return points, mathutils.Vector(root_point)
+
+def harvestPoints(options):
+    """Returns the points relative to the root, the root location and the particle seed"""
 
     # Determine from where to take points
     if options.point_data_type == 'PARTICLE':
         source_object = bpy.data.objects[options.source_object].evaluated_get(bpy.context.evaluated_depsgraph_get())  # Blender 2.80 requires this for accessing particles
         particle_system = source_object.particle_systems[options.source_particle_system]
         seed = particle_system.seed
-        particle_points = [(x.location[0], x.location[1], x.location[2]) for x in particle_system.particles]
+        particle_points = collectionLocations(particle_system.particles)
     elif options.point_data_type == 'GROUP':
         source_group = bpy.data.groups[options.source_group]
         seed = 0
-        particle_points = [(x.location[0], x.location[1], x.location[2]) for x in source_group.objects]
+        particle_points = collectionLocations(source_group.objects)
     else:
         seed = 0
 
     # Get starting point from object, cursor or first particle and create numpy array from it
     if options.root_data_type == 'OBJECT':
-        root_point = bpy.data.objects[options.root_data_object].location
-        root_list = [(root_point[0], root_point[1], root_point[2])]
-        root_list.extend(particle_points)
-        points = np.array(root_list) - root_point
+        root_point = tuple(bpy.data.objects[options.root_data_object].location)
+        points = np.concatenate(([root_point], particle_points)) - root_point
     elif options.root_data_type == 'CURSOR':
-        root_point = bpy.context.scene.cursor.location
-        root_list = [(root_point[0], root_point[1], root_point[2])]
-        root_list.extend(particle_points)
-        points = np.array(root_list) - root_point
+        root_point = tuple(bpy.context.scene.cursor.location)
+        points = np.concatenate(([root_point], particle_points)) - root_point
     else:
-        root_point = particle_points[0]
-        points = np.array(particle_points) - root_point
-
-    # Spin points randomly on an axis if enabled
-    if options.random_spin:
-        if options.spin_axis == 'Y':
-            up_axis = mathutils.Vector((0.0, 1.0, 0.0))
-        elif options.spin_axis == 'Z':
-            up_axis = mathutils.Vector((0.0, 0.0, 1.0))
-        else:
-            up_axis = mathutils.Vector((1.0, 0.0, 0.0))
-
-        axis = bpy.data.objects[options.spin_object].rotation_euler.to_matrix() @ up_axis
-        location = bpy.data.objects[options.spin_object].location - root_point
-
-        points = spinPoints(points, np.array(location), np.array(axis), options.spin_degrees, seed)
-
-    # Create the tree structure
-    root_node = mstree.mstree(points, balancing_factor = options.balancing_factor)
-
-    if options.add_thickness:
-        # Calculate the diameter of the tree
-        diameter.add_quad_diameter(root_node, scale = options.thickness_scale, offset = options.thickness_offset, path_scale = options.path_scale)
-
+        root_point = tuple(particle_points[0])
+        points = particle_points - root_point
+
+    return points, root_point, seed
+
+def collectionLocations(collection):
+    """Returns the locations of all particles or objects of a collection as (n, 3) array"""
+    # foreach_get copies all locations at once instead of creating a Python object per item
+    locations = np.empty(len(collection) * 3, dtype = np.float32)
+    collection.foreach_get("location", locations)
+    return locations.reshape(-1, 3).astype(np.float64)
+
+def surfaceNormals(obj, points, depsgraph = None):
+    """Returns the normal of the closest face of obj for every point in world space.
+
+    A BVH tree of the evaluated mesh is built once and queried for all points.
+    """
+    if depsgraph is None:
+        depsgraph = bpy.context.evaluated_depsgraph_get()
+    bvh = mathutils.bvhtree.BVHTree.FromObject(obj, depsgraph)
+
+    # The BVH tree is in object space, so transform the points there and the normals back
+    matrix = np.array(obj.matrix_world)
+    inverse = np.linalg.inv(matrix)
+    local_points = np.asarray(points) @ inverse[:3, :3].T + inverse[:3, 3]
+    normals = np.zeros((len(local_points), 3))
+    for i, point in enumerate(local_points.tolist()):
+        normal = bvh.find_nearest(point)[1]
+        if normal is not None:
+            normals[i] = normal
+
+    normals = normals @ inverse[:3, :3]
+    length = np.linalg.norm(normals, axis = 1, keepdims = True)
+    return np.divide(normals, length, out = normals, where = length > 0)
+
+def thicknessOptions(options):
+    """Returns the add_quad_diameter arguments of the options, or None without thickness"""
+    if not options.add_thickness:
+        return None
+    return {'scale': options.thickness_scale, 'offset': options.thickness_offset, 'path_scale': options.path_scale}
+
+def treeSettings(options):
+    """Returns the options used for computing trees as plain values, so worker threads don't read Blender data"""
+    simplify_errors = None
+    if options.simplify:
+        simplify_errors = (options.simplify_error, options.simplify_thickness_error if options.add_thickness else None)
+    return {'balancing_factor': options.balancing_factor, 'thickness': thicknessOptions(options), 'simplify': simplify_errors}
+
+def outputSignature(options):
+    """Returns a string of all options that change the geometry built from a tree"""
+    settings = treeSettings(options)
+    return repr((options.build_type, options.curve_type, options.tube_resolution, settings['thickness'], settings['simplify']))
+
+def dendriteTarget(options):
+    """Returns the names of the target object and particle system of the options"""
+    return (getattr(options, 'target_object', ""), getattr(options, 'target_particle_system', ""))
+
+def targetDendrites(objects, target):
+    """Returns the dendrites of a dendriteTarget among objects, by target index"""
+    return {obj[TARGET_INDEX]: obj for obj in objects if TARGET_INDEX in obj and (obj.get(TARGET_OBJECT), obj.get(TARGET_SYSTEM)) == target}
+
+def removeDendrites(objects):
+    """Removes objects and their mesh or curve data if no other object uses it"""
+    objects = list(objects)
+    data_users = {}
+    for obj in objects:
+        if obj.data is not None:
+            data_users[obj.data] = data_users.get(obj.data, 0) + 1
+    datablocks = objects + [data for data, count in data_users.items() if data.users <= count]
+
+    # Removing all at once only needs one pass over the file's datablocks
+    if hasattr(bpy.data, 'batch_remove'):
+        bpy.data.batch_remove(datablocks)
+    else:
+        for datablock in datablocks:
+            if isinstance(datablock, bpy.types.Object):
+                bpy.data.objects.remove(datablock)
+            elif isinstance(datablock, bpy.types.Mesh):
+                bpy.data.meshes.remove(datablock)
+            elif isinstance(datablock, bpy.types.Curve):
+                bpy.data.curves.remove(datablock)
+
+def buildTreeObject(tree, root_point, options):
+    """Builds the blender object of a computed tree"""
     # Build the blender object from the tree data
     if options.build_type == 'MESH':
-        obj = buildTreeMesh(root_node, options.add_thickness)
+        obj = buildTreeMesh(tree, options.add_thickness)
     elif options.build_type == 'CURVE':
-        obj = buildTreeCurve(root_node)
+        obj = buildTreeCurve(tree, options.curve_type)
         if options.add_thickness:
             obj.data.bevel_depth = 0.005
+    elif options.build_type == 'TUBE':
+        obj = buildTreeTube(tree, options.tube_resolution)
 
     obj.location = root_point
 
     return obj
 
-def createMultipleTrees(points, normals, options = None):
-    if normals is not None:
-        if len(points) != len(normals):
-            raise ValueError("Points and normals need to be the same length")
+def treeEngine(points):
+    """Returns the mstree engine for a point cloud, the grid engine for large clouds"""
+    return 'grid' if len(points) >= GRID_ENGINE_POINTS else 'exhaustive'
+
+def computeTree(points, settings, tree_cache, stats, progress = None):
+    """Computes the tree of points with the treeSettings, without touching Blender data.
+
+    progress is passed on to mstree, so this can run in a BackgroundTask.
+    """
+    # Create the tree structure, the cache skips this if only output settings changed
+    with stats.stage('mstree', points = len(points)) as record:
+        engine = treeEngine(points)
+        key = cache.tree_key(points, settings['balancing_factor'], engine)
+        tree = tree_cache.get(key)
+        record['cached'] = tree is not None
+        record['engine'] = engine
+        if tree is None:
+            tree = mstree.mstree(points, settings['balancing_factor'], engine = engine, compact = True, progress = progress)
+            tree_cache.put(key, tree)
+        record['nodes'] = len(tree)
+
+    if settings['thickness'] is not None:
+        # Calculate the diameter of the tree
+        with stats.stage('diameter', nodes = len(tree)):
+            diameter.add_quad_diameter(tree, **settings['thickness'])
+
+    if settings['simplify'] is not None:
+        with stats.stage('simplify', nodes = len(tree)) as record:
+            tree = simplify.simplify_tree(tree, *settings['simplify'])[0]
+            record['kept'] = len(tree)
 
+    return tree
+
+def createTreeObject(options = None, stats = None):
+    """Creates a tree object, the time of every stage is recorded in stats if given"""
     if options is None:
         options = bpy.context.scene.mst_options
+    if stats is None:
+        stats = StageStats()
+
+    points, root_point = gatherPoints(options, stats)
+    tree = computeTree(points, treeSettings(options), getTreeCache(), stats)
+
+    with stats.stage('build', nodes = len(tree)):
+        return buildTreeObject(tree, root_point, options)
+
+def prepareMultipleTrees(points, normals, options, stats, processes = 1, library_size = 0, reuse = None):
+    """Gathers the point clouds for createMultipleTrees and decides which trees are needed.
+
+    Returns a dict for computeMultipleTrees and buildMultipleTrees.
+    """
+    if normals is not None:
+        if len(points) != len(normals):
+            raise ValueError("Points and normals need to be the same length")
 
     ob = bpy.data.objects[options.source_object]
 
     particle_system = ob.particle_systems[options.source_particle_system]
     intial_seed = particle_system.seed
 
-    objects = []
+    tree_count = len(points)
+    if 0 < library_size < tree_count:
+        tree_count = library_size
 
-    for i, point in enumerate(points):
-        if normals is not None:
-            normal = normals[i]
-        else:
-            normal = (0,0,1)
+    # Gather the point clouds of every seed
+    point_clouds = []
+    root_points = []
+    for i in range(tree_count):
+        with stats.stage('update'):
+            particle_system.seed = intial_seed + i
 
-        particle_system.seed = intial_seed + i
+            # Update the view layer so the particle system gets updated
+            bpy.context.view_layer.update()
 
-        # Update the view layer so the particle system gets updated
-        bpy.context.view_layer.update()
+        tree_points, root_point = gatherPoints(options, stats)
+        point_clouds.append(tree_points)
+        root_points.append(root_point)
 
-        obj = createTreeObject(options)
+    particle_system.seed = intial_seed
+    bpy.context.view_layer.update()
+
+    # Blender versions before 2.91 report the Blender binary as sys.executable
+    if processes != 1 and hasattr(bpy.app, 'binary_path_python'):
+        multiprocessing.set_executable(bpy.app.binary_path_python)
+
+    # Objects of an earlier run on the same target are kept if their tree and
+    # output settings didn't change. A kept object also serves as the library
+    # object of its tree, so that tree is not computed again.
+    keys = [cache.tree_key(tree_points, options.balancing_factor) for tree_points in point_clouds]
+    tags = [key + outputSignature(options) + repr(dendriteTarget(options)) for key in keys]
+    if reuse is None:
+        reuse = {}
+    kept = {i: obj for i, obj in reuse.items() if i < len(points) and obj.get(TREE_TAG) == tags[i % tree_count]}
+    covered = set(i % tree_count for i in kept)
+    needed = sorted(set(i % tree_count for i in range(len(points)) if i % tree_count not in covered))
+
+    return {'points': points, 'normals': normals, 'seed': intial_seed, 'point_clouds': point_clouds, 'root_points': root_points,
+        'keys': keys, 'tags': tags, 'kept': kept, 'needed': needed, 'trees': [None] * tree_count}
+
+def computeMultipleTrees(job, settings, tree_cache, processes, stats, progress = None):
+    """Computes the needed trees of a prepareMultipleTrees job, without touching Blender data.
+
+    progress gets the number of attached points, so this can run in a BackgroundTask.
+    """
+    point_clouds, keys, needed, trees = job['point_clouds'], job['keys'], job['needed'], job['trees']
+
+    # Only compute the trees that are not cached
+    with stats.stage('mstree', points = sum(len(point_clouds[i]) for i in needed)) as record:
+        for i in needed:
+            trees[i] = tree_cache.get(keys[i])
+        missing = [i for i in needed if trees[i] is None]
+        computed = mstree.mstree_batch([point_clouds[i] for i in missing], settings['balancing_factor'], compact = True, processes = processes, progress = progress)
+        for i, tree in zip(missing, computed):
+            tree_cache.put(keys[i], tree)
+            trees[i] = tree
+        record['trees'] = len(needed)
+        record['computed'] = len(missing)
+        record['nodes'] = sum(len(trees[i]) for i in needed)
+
+    if settings['thickness'] is not None:
+        with stats.stage('diameter', trees = len(needed)):
+            for i in needed:
+                diameter.add_quad_diameter(trees[i], **settings['thickness'])
+
+    if settings['simplify'] is not None:
+        with stats.stage('simplify', nodes = sum(len(trees[i]) for i in needed)) as record:
+            for i in needed:
+                trees[i] = simplify.simplify_tree(trees[i], *settings['simplify'])[0]
+            record['kept'] = sum(len(trees[i]) for i in needed)
+
+    return job
+
+def buildMultipleTrees(job, options, stats):
+    """Builds or moves the objects of a computed prepareMultipleTrees job"""
+    points, normals, kept, trees, tags = job['points'], job['normals'], job['kept'], job['trees'], job['tags']
+    tree_count = len(trees)
+    target = dendriteTarget(options)
+    objects = []
 
-        obj.location = mathutils.Vector(point)
+    # Instances of the same tree get a random rotation around the normal
+    angles = None
+    if tree_count < len(points):
+        angles = np.random.default_rng(job['seed']).random(len(points)) * 2 * math.pi
+
+    with stats.stage('build', trees = len(job['needed']), objects = len(points) - len(kept)):
+        library = [None] * tree_count
+        for i, obj in kept.items():
+            library[i % tree_count] = obj
+
+        for i, point in enumerate(points):
+            if normals is not None:
+                normal = normals[i]
+            else:
+                normal = (0,0,1)
+
+            tree_index = i % tree_count
+            if i in kept:
+                obj = kept[i]
+            elif library[tree_index] is None:
+                obj = buildTreeObject(trees[tree_index], job['root_points'][tree_index], options)
+                library[tree_index] = obj
+            else:
+                # Linked duplicate, the copy keeps the modifiers but shares the data
+                obj = library[tree_index].copy()
+                bpy.context.scene.collection.objects.link(obj)
+            obj[TREE_TAG] = tags[tree_index]
+            obj[TARGET_INDEX] = i
+            obj[TARGET_OBJECT], obj[TARGET_SYSTEM] = target
+
+            obj.location = mathutils.Vector(point)
+
+            obj.rotation_mode = 'QUATERNION'
+            rotation = mathutils.Vector(normal).to_track_quat('Z', 'Y')
+            if angles is not None:
+                rotation = rotation @ mathutils.Quaternion((0.0, 0.0, 1.0), angles[i])
+            obj.rotation_quaternion = rotation
+
+            objects.append(obj)
 
-        obj.rotation_mode = 'QUATERNION'
-        obj.rotation_quaternion = mathutils.Vector(normal).to_track_quat('Z', 'Y')
+    return objects
 
-        objects.append(obj)
+def createMultipleTrees(points, normals, options = None, processes = 1, stats = None, library_size = 0, reuse = None):
+    """Creates a tree at every point, using a new particle seed for each tree.
 
-    particle_system.seed = intial_seed
+    The point clouds of all seeds are gathered first, the trees that are not
+    cached are then computed together with mstree_batch, split across a process
+    pool with more than one process (0 uses all cores). The objects are built
+    once all trees are done. The time of every stage is recorded in stats if given.
 
-    return objects
+    With a library_size smaller than the number of points only that many trees
+    are computed. They are placed in turns as linked duplicates, which share
+    their mesh or curve, each rotated randomly around its normal.
+
+    reuse maps target indices to the objects of an earlier run on the same
+    target, see targetDendrites. Those whose tree and output settings are
+    unchanged are moved to their point instead of being built again; the caller
+    removes the others with removeDendrites.
+    """
+    if options is None:
+        options = bpy.context.scene.mst_options
+    if stats is None:
+        stats = StageStats()
+
+    job = prepareMultipleTrees(points, normals, options, stats, processes, library_size, reuse)
+    computeMultipleTrees(job, treeSettings(options), getTreeCache(), processes, stats)
+    return buildMultipleTrees(job, options, stats)
 
 
 # --- Operators ---
@@ -233,21 +556,43 @@ class OBJECT_OT_mstadd(bpy.types.Operator):
         name = "Build type",
         items = (
             ('MESH', 'Mesh', 'Build the tree out of vertices'),
-            ('CURVE', 'Curve', 'Build the tree out of curves')
+            ('CURVE', 'Curve', 'Build the tree out of curves'),
+            ('TUBE', 'Tube', 'Build the tree out of a mesh of tubes, without a Skin modifier')
         ),
         default = 'MESH'
     )
 
+    curve_type : bpy.props.EnumProperty(
+        name = "Curve type",
+        items = (
+            ('BEZIER', 'Bezier', 'Build the curve out of bezier splines'),
+            ('POLY', 'Poly', 'Build the curve out of lighter poly splines')
+        ),
+        default = 'BEZIER'
+    )
+
+    tube_resolution : bpy.props.IntProperty(name = "Tube resolution", description = "Number of vertices around the tubes", min = 3, max = 64, default = 8)
+
     random_spin : bpy.props.BoolProperty(name = "Random spin", default = False)
     spin_object : bpy.props.StringProperty(name = "Axis object")
     spin_degrees : bpy.props.FloatProperty(name = "Spin degrees", subtype = 'ANGLE', min = 0.0, max = 2*math.pi, default = math.pi)
     spin_axis : bpy.props.EnumProperty(name = "Spin axis", items = (('X', 'X', 'Spin along the X-axis of the object'), ('Y', 'Y', 'Spin along the Y-axis of the object'), ('Z', 'Z', 'Spin along the Z-axis of the object')), default = 'Y')
+    legacy_spin : bpy.props.BoolProperty(name = "Legacy spin", description = "Draw the spin angles like earlier versions to reproduce their results", default = False)
 
     add_thickness : bpy.props.BoolProperty(name = "Add thickness")
     thickness_scale : bpy.props.FloatProperty(name = "Scale", min = 0.0, default = 1.0)
     thickness_offset : bpy.props.FloatProperty(name = "Offset", min = 0.0, default = 0.5)
     path_scale : bpy.props.FloatProperty(name = "Path scale", min = 0.0, default = 100.0)
 
+    simplify : bpy.props.BoolProperty(name = "Simplify", description = "Remove nodes of unbranched paths that are nearly on a line", default = False)
+    simplify_error : bpy.props.FloatProperty(name = "Max distance", description = "Maximum distance of a removed node to the simplified path", subtype = 'DISTANCE', min = 0.0, default = 0.01)
+    simplify_thickness_error : bpy.props.FloatProperty(name = "Max thickness error", description = "Maximum difference of a removed node's thickness to the simplified path", min = 0.0, default = 0.1)
+
+    run_in_background : bpy.props.BoolProperty(name = "Run in background", description = "Compute the trees without blocking Blender, press Esc to cancel", default = False)
+
+    report_stats : bpy.props.BoolProperty(name = "Report timing", description = "Report the time and memory every stage of the tree creation took", default = False)
+    stats_file : bpy.props.StringProperty(name = "Timing file", description = "Also write the timing of every stage as JSON to this file", subtype = 'FILE_PATH')
+
     def invoke(self, context, event):
         ao = context.active_object
         if ao is not None:
@@ -289,6 +634,13 @@ class OBJECT_OT_mstadd(bpy.types.Operator):
         row = layout.row()
         row.prop(op, "build_type")
 
+        if op.build_type == 'CURVE':
+            row = layout.row()
+            row.prop(op, "curve_type")
+        elif op.build_type == 'TUBE':
+            row = layout.row()
+            row.prop(op, "tube_resolution")
+
         row = layout.row()
         row.prop(op, "random_spin")
 
@@ -302,6 +654,9 @@ class OBJECT_OT_mstadd(bpy.types.Operator):
             row = layout.row()
             row.prop(op, "spin_degrees")
 
+            row = layout.row()
+            row.prop(op, "legacy_spin")
+
         row = layout.row()
         row.prop(op, "add_thickness")
 
@@ -315,8 +670,107 @@ class OBJECT_OT_mstadd(bpy.types.Operator):
             row = layout.row()
             row.prop(op, "path_scale")
 
+        row = layout.row()
+        row.prop(op, "simplify")
+
+        if op.simplify:
+            row = layout.row()
+            row.prop(op, "simplify_error")
+
+            if op.add_thickness:
+                row = layout.row()
+                row.prop(op, "simplify_thickness_error")
+
+        row = layout.row()
+        row.prop(op, "run_in_background")
+
+        row = layout.row()
+        row.prop(op, "report_stats")
+
+        if op.report_stats:
+            row = layout.row()
+            row.prop(op, "stats_file")
+
+    def newStats(self):
+        """Returns a stats collector, memory is only traced when the timing is reported"""
+        return StageStats(trace_memory = self.report_stats)
+
+    def reportStats(self, stats):
+        if not self.report_stats:
+            return
+        self.report({'INFO'}, stats.summary())
+        if self.stats_file:
+            stats.write(bpy.path.abspath(self.stats_file))
+
+    def prepareTrees(self, context, stats):
+        """Gathers the input on the main thread. Returns a function computing the
+        trees, which doesn't touch Blender data, and a function building their objects."""
+        points, root_point = gatherPoints(self, stats)
+        compute = functools.partial(computeTree, points, treeSettings(self), getTreeCache(), stats)
+
+        def build(tree):
+            with stats.stage('build', nodes = len(tree)):
+                buildTreeObject(tree, root_point, self)
+
+        return compute, build
+
     def execute(self, context):
-        createTreeObject(self)
+        stats = self.newStats()
+        compute, build = self.prepareTrees(context, stats)
+        if self.run_in_background:
+            return self.startBackground(context, compute, build, stats)
+
+        build(compute())
+        self.reportStats(stats)
+        return {'FINISHED'}
+
+    # Computing in the background, the objects are built on the main thread
+    # once the task is done. Esc cancels the task, which stops the computation
+    # and shuts down its process pool.
+
+    def startBackground(self, context, compute, build, stats):
+        self._task = background.BackgroundTask(compute).start()
+        self._build = build
+        self._stats = stats
+
+        wm = context.window_manager
+        self._timer = wm.event_timer_add(0.1, window = context.window)
+        wm.progress_begin(0, 100)
+        wm.modal_handler_add(self)
+        return {'RUNNING_MODAL'}
+
+    def stopBackground(self, context):
+        wm = context.window_manager
+        wm.event_timer_remove(self._timer)
+        wm.progress_end()
+        context.workspace.status_text_set(None)
+
+    def modal(self, context, event):
+        if event.type == 'ESC' and event.value == 'PRESS':
+            self._task.cancel()
+            self.stopBackground(context)
+            self.report({'WARNING'}, "Tree creation cancelled")
+            return {'CANCELLED'}
+
+        if event.type != 'TIMER':
+            return {'PASS_THROUGH'}
+
+        done, total = self._task.progress
+        if total:
+            context.window_manager.progress_update(100 * done / total)
+            context.workspace.status_text_set("Computing trees: %d / %d points, press Esc to cancel" % (done, total))
+        if not self._task.done:
+            return {'PASS_THROUGH'}
+
+        self.stopBackground(context)
+        try:
+            result = self._task.result()
+        except Exception as e:
+            self.report({'ERROR'}, "Tree creation failed: %s" % e)
+            return {'CANCELLED'}
+
+        self._build(result)
+        self.reportStats(self._stats)
         return {'FINISHED'}
 
 class OBJECT_OT_dendriteadd(OBJECT_OT_mstadd):
@@ -355,24 +809,50 @@ class OBJECT_OT_dendriteadd(OBJECT_OT_mstadd):
         name = "Build type",
         items = (
             ('MESH', 'Mesh', 'Build the tree out of vertices'),
-            ('CURVE', 'Curve', 'Build the tree out of curves')
+            ('CURVE', 'Curve', 'Build the tree out of curves'),
+            ('TUBE', 'Tube', 'Build the tree out of a mesh of tubes, without a Skin modifier')
         ),
         default = 'MESH'
     )
 
+    curve_type : bpy.props.EnumProperty(
+        name = "Curve type",
+        items = (
+            ('BEZIER', 'Bezier', 'Build the curve out of bezier splines'),
+            ('POLY', 'Poly', 'Build the curve out of lighter poly splines')
+        ),
+        default = 'BEZIER'
+    )
+
+    tube_resolution : bpy.props.IntProperty(name = "Tube resolution", description = "Number of vertices around the tubes", min = 3, max = 64, default = 8)
+
     random_spin : bpy.props.BoolProperty(name = "Random spin", default = False)
     spin_object : bpy.props.StringProperty(name = "Axis object")
     spin_degrees : bpy.props.FloatProperty(name = "Spin degrees", subtype = 'ANGLE', min = 0.0, max = 2*math.pi, default = math.pi)
     spin_axis : bpy.props.EnumProperty(name = "Spin axis", items = (('X', 'X', 'Spin along the X-axis of the object'), ('Y', 'Y', 'Spin along the Y-axis of the object'), ('Z', 'Z', 'Spin along the Z-axis of the object')), default = 'Y')
+    legacy_spin : bpy.props.BoolProperty(name = "Legacy spin", description = "Draw the spin angles like earlier versions to reproduce their results", default = False)
 
     add_thickness : bpy.props.BoolProperty(name = "Add thickness")
     thickness_scale : bpy.props.FloatProperty(name = "Scale", min = 0.0, default = 1.0)
     thickness_offset : bpy.props.FloatProperty(name = "Offset", min = 0.0, default = 0.5)
     path_scale : bpy.props.FloatProperty(name = "Path scale", min = 0.0, default = 100.0)
 
+    simplify : bpy.props.BoolProperty(name = "Simplify", description = "Remove nodes of unbranched paths that are nearly on a line", default = False)
+    simplify_error : bpy.props.FloatProperty(name = "Max distance", description = "Maximum distance of a removed node to the simplified path", subtype = 'DISTANCE', min = 0.0, default = 0.01)
+    simplify_thickness_error : bpy.props.FloatProperty(name = "Max thickness error", description = "Maximum difference of a removed node's thickness to the simplified path", min = 0.0, default = 0.1)
+
+    run_in_background : bpy.props.BoolProperty(name = "Run in background", description = "Compute the trees without blocking Blender, press Esc to cancel", default = False)
+
+    report_stats : bpy.props.BoolProperty(name = "Report timing", description = "Report the time and memory every stage of the tree creation took", default = False)
+    stats_file : bpy.props.StringProperty(name = "Timing file", description = "Also write the timing of every stage as JSON to this file", subtype = 'FILE_PATH')
+
     target_object: bpy.props.StringProperty(name = "Target object")
     target_particle_system: bpy.props.StringProperty(name = "Target particle system")
 
+    processes: bpy.props.IntProperty(name = "Processes", description = "Number of worker processes for computing the trees, 0 uses all cores", min = 0, default = 1)
+
+    library_size: bpy.props.IntProperty(name = "Unique trees", description = "Number of different trees placed as linked duplicates on the targets, 0 creates a tree for every target", min = 0, default = 0)
+
     def draw(self, context):
         op = self
 
@@ -387,8 +867,14 @@ class OBJECT_OT_dendriteadd(OBJECT_OT_mstadd):
             row = layout.row()
             row.prop_search(op, "target_particle_system", bpy.data.objects[op.target_object], "particle_systems")
 
+        row = layout.row()
+        row.prop(op, "processes")
 
-    def execute(self, context):
+        row = layout.row()
+        row.prop(op, "library_size")
+
+
+    def prepareTrees(self, context, stats):
         options = self
 
         if DENDRITE_GROUP_NAME not in bpy.data.collections:
@@ -401,17 +887,28 @@ class OBJECT_OT_dendriteadd(OBJECT_OT_mstadd):
 
         particle_system = ob.particle_systems[options.target_particle_system]
 
-        points = [(x.location[0], x.location[1], x.location[2]) for x in particle_system.particles]
+        with stats.stage('targets') as record:
+            points = collectionLocations(particle_system.particles)
+            normals = surfaceNormals(bpy.data.objects[options.target_object], points)
+            record['points'] = len(points)
 
-        normals = [bpy.data.objects[options.target_object].closest_point_on_mesh(x.location)[1] for x in particle_system.particles]
+        # Trees of an earlier run on this target are regenerated in place,
+        # dendrites of other targets are left alone
+        existing = targetDendrites(group.objects, dendriteTarget(self))
+        job = prepareMultipleTrees(points, normals, self, stats, self.processes, self.library_size, existing)
+        compute = functools.partial(computeMultipleTrees, job, treeSettings(self), getTreeCache(), self.processes, stats)
 
-        trees = createMultipleTrees(points, normals, self)
+        def build(job):
+            trees = buildMultipleTrees(job, self, stats)
 
-        # Add trees to group
-        for tree in trees:
-            group.objects.link(tree)
+            # Add new trees to group and remove the replaced ones
+            used = set(trees)
+            for tree in trees:
+                if tree.name not in group.objects:
+                    group.objects.link(tree)
+            removeDendrites([obj for obj in existing.values() if obj not in used])
 
-        return {'FINISHED'}
+        return compute, build
 
 class OBJECT_OT_dendritedelete(bpy.types.Operator):
     bl_idname = "object.delete_mst_dendrites"
@@ -419,10 +916,60 @@ class OBJECT_OT_dendritedelete(bpy.types.Operator):
 
     def execute(self, context):
         if DENDRITE_GROUP_NAME in bpy.data.collections:
-            trees = bpy.data.collections[DENDRITE_GROUP_NAME].objects
-            for tree in trees:
-                context.scene.collection.objects.unlink(tree)
-                bpy.data.objects.remove(tree)
+            removeDendrites(bpy.data.collections[DENDRITE_GROUP_NAME].objects)
 
         return {'FINISHED'}
 
+
+
+# --- Registration ---
+
+class MSTPreferences(bpy.types.AddonPreferences):
+    bl_idname = __package__
+
+    cache_size : bpy.props.IntProperty(name = "Tree cache size (MB)", description = "Memory used for keeping computed trees", min = 0, default = 256)
+    cache_directory : bpy.props.StringProperty(name = "Tree cache directory", description = "Also store computed trees in this directory", subtype = 'DIR_PATH')
+
+    def draw(self, context):
+        layout = self.layout
+        row = layout.row()
+        row.prop(self, "cache_size")
+        row = layout.row()
+        row.prop(self, "cache_directory")
+
+def menu_draw(self, context):
+    layout = self.layout
+    layout.menu("VIEW3D_MT_minimum_spanning_tree",
+                text="Minimum Spanning Tree",
+                icon="PARTICLES")
+
+class VIEW3D_MT_minimum_spanning_tree(bpy.types.Menu):
+    # Define the "Single Vert" menu
+    bl_idname = "VIEW3D_MT_minimum_spanning_tree"
+    bl_label = "Minimum Spanning Tree"
+
+    def draw(self, context):
+        layout = self.layout
+        layout.operator_context = 'INVOKE_REGION_WIN'
+        layout.operator("object.add_minimum_spanning_tree")
+        layout.operator("object.add_mst_dendrites")
+
+def register():
+    registerclasses()
+    # Add menu entry
+    bpy.types.VIEW3D_MT_mesh_add.append(menu_draw)
+
+def unregister():
+    unregisterclasses()
+    # Remove menu entry
+    bpy.types.VIEW3D_MT_mesh_add.remove(menu_draw)
+
+classes = (
+    MSTPreferences,
+    OBJECT_OT_dendritedelete,
+    OBJECT_OT_dendriteadd,
+    OBJECT_OT_mstadd,
+    VIEW3D_MT_minimum_spanning_tree
+)
+
+registerclasses, unregisterclasses = bpy.utils.register_classes_factory(classes)
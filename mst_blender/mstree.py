@@ -1,5 +1,10 @@
+from . import traversal
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 
+# Number of attached points between calls of a progress callback
+PROGRESS_INTERVAL = 1024
+
 class Node:
 	def __init__(self, parent, pos, index, path_distance = 0.0):
 		self.parent = parent
@@ -11,65 +16,737 @@ class Node:
 		if parent is not None:
 			parent.children.append(self)
 
-def mstree(points, balancing_factor = 0.5):
+class ArrayTree:
+	"""Compact tree stored as flat arrays instead of Node objects.
+
+	All arrays are indexed by point index and the root is point 0. The children
+	of node i are children[child_offsets[i]:child_offsets[i + 1]] in the order
+	they were attached, so dfs_order is the same order tree_to_list returns for
+	the equivalent Node graph.
+	"""
+	_array_names = ('positions', 'parents', 'path_distances', 'children', 'child_offsets', 'dfs_order')
+
+	def __init__(self, positions, parents, path_distances, order = None):
+		self.positions = positions
+		self.parents = parents
+		self.path_distances = path_distances
+		self.thickness = None
+
+		length = len(parents)
+		if order is None:
+			order = np.arange(length)
+		rank = np.empty(length, dtype = int)
+		rank[order] = np.arange(length)
+
+		# Children in CSR layout, sorted by parent and then by attach order
+		non_root = np.flatnonzero(parents >= 0)
+		self.children = non_root[np.lexsort((rank[non_root], parents[non_root]))]
+		self.child_offsets = np.zeros(length + 1, dtype = int)
+		np.cumsum(np.bincount(parents[non_root], minlength = length), out = self.child_offsets[1:])
+
+		# Iterative depth-first-search, children are pushed in reverse
+		children = self.children.tolist()
+		offsets = self.child_offsets.tolist()
+		dfs_order = []
+		stack = [int(order[0])]
+		while stack:
+			index = stack.pop()
+			dfs_order.append(index)
+			stack.extend(reversed(children[offsets[index]:offsets[index + 1]]))
+		self.dfs_order = np.array(dfs_order, dtype = int)
+
+	def __len__(self):
+		return len(self.parents)
+
+	def to_arrays(self):
+		"""Returns all arrays of the tree as a dict, e.g. for np.savez"""
+		arrays = {name: getattr(self, name) for name in self._array_names}
+		if self.thickness is not None:
+			arrays['thickness'] = self.thickness
+		return arrays
+
+	@classmethod
+	def from_arrays(cls, arrays):
+		"""Creates an ArrayTree from the dict of to_arrays without recomputing anything"""
+		tree = cls.__new__(cls)
+		for name in cls._array_names:
+			setattr(tree, name, arrays[name])
+		tree.thickness = arrays['thickness'] if 'thickness' in arrays else None
+		return tree
+
+	def terminals(self):
+		"""Returns the indices of all nodes without children"""
+		return np.flatnonzero(self.child_offsets[1:] == self.child_offsets[:-1])
+
+	def paths(self):
+		"""Splits the depth-first order into unbranched paths.
+
+		A path follows the first child at every branch point and ends at a tip,
+		every other path starts at its branch point. Returns the nodes of all
+		paths concatenated and the boundaries, path i is
+		nodes[boundaries[i]:boundaries[i + 1]].
+		"""
+		order = self.dfs_order
+		starts = np.flatnonzero(self.parents[order[1:]] != order[:-1]) + 1
+		nodes = np.insert(order, starts, self.parents[order[starts]])
+		boundaries = np.concatenate(([0], starts + np.arange(len(starts)), [len(nodes)]))
+		return nodes, boundaries
+
+	def subtree_ends(self):
+		"""Returns for every node the position in dfs_order after its last descendant.
+
+		The end of a node is the position of its next sibling, or the end of its
+		parent if it is the last child. The parent chains are resolved with
+		pointer jumping, so only a logarithmic number of passes is needed.
+		"""
+		length = len(self)
+		position = np.empty(length, dtype = int)
+		position[self.dfs_order] = np.arange(length)
+
+		ends = np.full(length, -1, dtype = int)
+		ends[self.dfs_order[0]] = length
+		sibling = np.arange(len(self.children) - 1)
+		has_sibling = sibling + 1 < self.child_offsets[self.parents[self.children[:-1]] + 1]
+		ends[self.children[:-1][has_sibling]] = position[self.children[1:][has_sibling]]
+
+		pointer = self.parents.copy()
+		unresolved = np.flatnonzero(ends < 0)
+		while len(unresolved):
+			known = ends[pointer[unresolved]] >= 0
+			ends[unresolved[known]] = ends[pointer[unresolved[known]]]
+			unresolved = unresolved[~known]
+			pointer[unresolved] = pointer[pointer[unresolved]]
+		return ends
+
+	def to_nodes(self):
+		"""Creates the equivalent Node graph and returns its root node"""
+		nodes = {}
+		parents = self.parents.tolist()
+		for index in self.dfs_order.tolist():
+			parent_index = parents[index]
+			parent_node = nodes[parent_index] if parent_index >= 0 else None
+			node = Node(parent_node, self.positions[index], index, self.path_distances[index])
+			if self.thickness is not None:
+				node.thickness = self.thickness[index]
+			nodes[index] = node
+		return nodes[self.dfs_order[0]]
+
+	@classmethod
+	def from_nodes(cls, root_node):
+		"""Creates an ArrayTree from a Node graph, nodes need unique indices from 0 to n-1"""
+		nodes = traversal.pre_order(root_node)
+		length = len(nodes)
+		positions = np.empty((length, len(root_node.pos)))
+		parents = np.empty(length, dtype = int)
+		path_distances = np.empty(length)
+		order = np.empty(length, dtype = int)
+		for i, node in enumerate(nodes):
+			positions[node.index] = node.pos
+			parents[node.index] = node.parent.index if node.parent is not None else -1
+			path_distances[node.index] = node.path_distance
+			order[i] = node.index
+		tree = cls(positions, parents, path_distances, order)
+		if all(hasattr(node, 'thickness') for node in nodes):
+			tree.thickness = np.empty(length)
+			for node in nodes:
+				tree.thickness[node.index] = node.thickness
+		return tree
+
+def mstree(points, balancing_factor = 0.5, engine = 'exhaustive', compact = False, dtype = np.float64, progress = None):
+	"""Builds a minimum spanning tree with balancing factor rooted at points[0].
+
+	engine selects how candidate distances are updated: 'exhaustive' updates
+	every open point on every step, 'grid' uses a uniform grid over the points
+	to only update points that can actually get closer. Both return the same tree.
+	'partitioned' builds an approximate tree with the default settings of
+	mstree_partitioned, for point clouds too large for the exact engines.
+
+	dtype is the precision used for the points and distances. np.float32 halves
+	the memory used, but ties may be broken differently than with np.float64.
+
+	progress is called as progress(attached, total) every PROGRESS_INTERVAL
+	attached points and at the end. An exception raised by it aborts mstree.
+
+	Returns the root Node, or an ArrayTree if compact is set.
+	"""
+	points = np.asarray(points, dtype = dtype)
+	if engine == 'exhaustive':
+		order, parents, path_distances = _exhaustive_engine(points, balancing_factor, progress)
+	elif engine == 'grid':
+		order, parents, path_distances = _grid_engine(points, balancing_factor, progress = progress)
+	elif engine == 'partitioned':
+		order, parents, path_distances = _partitioned_engine(points, balancing_factor, 1024, 1)
+	else:
+		raise ValueError("Unknown engine '%s'" % engine)
+	if progress is not None:
+		progress(len(points), len(points))
+
+	if compact:
+		return ArrayTree(points, parents, path_distances, order)
+	return _build_nodes(points, order, parents, path_distances)
+
+def mstree_batch(point_clouds, balancing_factor = 0.5, compact = False, processes = 1, max_elements = 2**21, progress = None):
+	"""Builds the trees of many small point clouds at once, in input order.
+
+	The point clouds are sorted by size and stacked into padded arrays of at
+	most max_elements points, and all trees of such a stack are advanced
+	together, so the per step overhead is shared. balancing_factor can also be a
+	list with one value per point cloud. The trees are the same mstree builds.
+
+	With processes other than 1 the point clouds are split across a process
+	pool, 0 uses all cores. progress is called as progress(attached, total)
+	with the number of attached points of all clouds, every PROGRESS_INTERVAL
+	points and after every stack, or after every batch of the process pool.
+	"""
+	point_clouds = [np.asarray(points, dtype = float) for points in point_clouds]
+	balancing_factors = np.broadcast_to(np.asarray(balancing_factor, dtype = float), (len(point_clouds),))
+
+	if processes != 1:
+		from . import parallel
+		trees = parallel.build_batches(point_clouds, balancing_factors, processes, progress)
+		return trees if compact else [tree.to_nodes() for tree in trees]
+
+	trees = [None] * len(point_clouds)
+	total = sum(len(points) for points in point_clouds)
+	finished = 0
+	by_size = sorted(range(len(point_clouds)), key = lambda i: -len(point_clouds[i]))
+	while by_size:
+		# The largest remaining cloud determines the padded size of the stack,
+		# clouds less than half as large go into a later stack
+		largest = len(point_clouds[by_size[0]])
+		stack_size = max(1, max_elements // largest)
+		stack = [i for i in by_size[:stack_size] if 2 * len(point_clouds[i]) >= largest]
+		by_size = by_size[len(stack):]
+		stack_progress = None
+		if progress is not None:
+			stack_progress = lambda attached, stack_total: progress(finished + attached, total)
+		results = _stacked_engine([point_clouds[i] for i in stack], balancing_factors[stack], stack_progress)
+		for i, (order, parents, path_distances) in zip(stack, results):
+			if compact:
+				trees[i] = ArrayTree(point_clouds[i], parents, path_distances, order)
+			else:
+				trees[i] = _build_nodes(point_clouds[i], order, parents, path_distances)
+		finished += sum(len(point_clouds[i]) for i in stack)
+		if progress is not None:
+			progress(finished, total)
+	return trees
+
+def mstree_sweep(points, balancing_factors, compact = False, max_bytes = 2**30, threads = 1):
+	"""Builds the trees of the same points for several balancing factors.
+
+	If the pairwise distance matrix fits into max_bytes it is computed once, in
+	blocks, and every tree only looks up its distances in it. Otherwise the
+	trees are advanced together like in mstree_batch. threads splits the
+	balancing factors across threads, which share the distance matrix.
+	The trees are the same mstree builds.
+
+	Returns a list with one tree per balancing factor.
+	"""
+	points = np.asarray(points, dtype = float)
+	balancing_factors = np.asarray(balancing_factors, dtype = float).ravel()
 	length = len(points)
-	dimensions = len(points[0])
 
-	closed_list = {}
+	if length * length * points.itemsize <= max_bytes:
+		distances = _distance_matrix(points, max_bytes // 8)
+		engine = lambda factors: _sweep_engine(distances, factors)
+	else:
+		engine = lambda factors: _stacked_engine([points] * len(factors), factors)
+
+	chunks = [chunk for chunk in np.array_split(balancing_factors, max(1, threads)) if len(chunk)]
+	if len(chunks) > 1:
+		with ThreadPoolExecutor(max_workers = len(chunks)) as pool:
+			results = [result for chunk_results in pool.map(engine, chunks) for result in chunk_results]
+	else:
+		results = [result for chunk in chunks for result in engine(chunk)]
+
+	if compact:
+		return [ArrayTree(points, parents, path_distances, order) for order, parents, path_distances in results]
+	return [_build_nodes(points, order, parents, path_distances) for order, parents, path_distances in results]
+
+def mstree_partitioned(points, balancing_factor = 0.5, compact = False, points_per_partition = 1024, processes = 1):
+	"""Builds an approximate tree of a large point cloud from the trees of its parts.
+
+	The points are split at the median of their widest axis until no part has
+	more than points_per_partition points. A tree over the part centers, with
+	the root standing in for the center of its part, decides to which part every
+	part is attached, through a close pair of points of both parts. The trees of
+	all parts are computed with mstree_batch, across a process pool with
+	processes other than 1, and joined at these pairs. Path distances are
+	measured from the global root.
+
+	The result is not the tree mstree builds, partition_quality compares both.
+	"""
+	points = np.asarray(points, dtype = float)
+	order, parents, path_distances = _partitioned_engine(points, balancing_factor, points_per_partition, processes)
+	if compact:
+		return ArrayTree(points, parents, path_distances, order)
+	return _build_nodes(points, order, parents, path_distances)
+
+def tree_statistics(tree):
+	"""Returns the total edge length and the mean path distance of an ArrayTree"""
+	non_root = np.flatnonzero(tree.parents >= 0)
+	lengths = np.sqrt(np.sum(np.square(tree.positions[non_root] - tree.positions[tree.parents[non_root]]), axis = 1))
+	return {'total_length': float(np.sum(lengths)), 'mean_path_distance': float(np.mean(tree.path_distances))}
+
+def partition_quality(points, balancing_factor = 0.5, sample_size = 4096, seed = 0, points_per_partition = 1024, processes = 1):
+	"""Compares mstree_partitioned with mstree on a random sample of the points.
+
+	The sample keeps the root and is split into as many parts as the whole point
+	cloud would be. Returns the tree_statistics of both trees and the ratios of
+	the approximate to the exact values.
+	"""
+	points = np.asarray(points, dtype = float)
+	if len(points) > sample_size:
+		sample = np.random.default_rng(seed).choice(np.arange(1, len(points)), sample_size - 1, replace = False)
+		points_per_partition = max(2, points_per_partition * sample_size // len(points))
+		points = points[np.concatenate(([0], sample))]
+
+	exact = tree_statistics(mstree(points, balancing_factor, engine = 'grid', compact = True))
+	approximate = tree_statistics(mstree_partitioned(points, balancing_factor, compact = True, points_per_partition = points_per_partition, processes = processes))
+	quality = {'exact': exact, 'approximate': approximate}
+	for name in exact:
+		quality[name + '_ratio'] = approximate[name] / exact[name] if exact[name] > 0 else 1.0
+	return quality
+
+def _partition(points, size):
+	"""Splits the indices of points at the median of the widest axis until every part has at most size points"""
+	parts = []
+	stack = [np.arange(len(points))]
+	while stack:
+		indices = stack.pop()
+		if len(indices) <= size:
+			parts.append(indices)
+			continue
+		coordinates = points[indices]
+		axis = np.argmax(np.ptp(coordinates, axis = 0))
+		half = len(indices) // 2
+		split = np.argpartition(coordinates[:, axis], half)
+		stack.append(indices[split[half:]])
+		stack.append(indices[split[:half]])
+	return parts
+
+def _closest(points, indices, location):
+	return indices[np.argmin(np.sum(np.square(points[indices] - location), axis = 1))]
+
+def _partitioned_engine(points, balancing_factor, points_per_partition, processes):
+	"""Computes the approximate tree of mstree_partitioned.
+
+	Returns (attach order, parent indices, path distances) like the exact engines.
+	"""
+	parts = _partition(points, max(1, points_per_partition))
+	part_of = np.empty(len(points), dtype = int)
+	for i, part in enumerate(parts):
+		part_of[part] = i
+	root_part = part_of[0]
+
+	# Tree over the parts, with the root part first
+	centers = np.array([points[part].mean(axis = 0) for part in parts])
+	centers[root_part] = points[0]
+	part_order = np.concatenate(([root_part], np.delete(np.arange(len(parts)), root_part)))
+	coarse = mstree(centers[part_order], balancing_factor, compact = True)
+	part_parents = np.full(len(parts), -1)
+	part_parents[part_order[1:]] = part_order[coarse.parents[1:]]
+
+	# Every part is entered at a point close to its parent part, found by
+	# alternating closest point searches between both parts
+	entries = np.zeros(len(parts), dtype = int)
+	anchors = np.full(len(parts), -1)
+	for i, part in enumerate(parts):
+		if i == root_part:
+			continue
+		parent_part = parts[part_parents[i]]
+		entry = _closest(points, part, centers[part_parents[i]])
+		for _ in range(2):
+			anchor = _closest(points, parent_part, points[entry])
+			entry = _closest(points, part, points[anchor])
+		entries[i] = entry
+		anchors[i] = _closest(points, parent_part, points[entry])
+
+	local_indices = [np.concatenate(([entries[i]], part[part != entries[i]])) for i, part in enumerate(parts)]
+	trees = mstree_batch([points[indices] for indices in local_indices], balancing_factor, compact = True, processes = processes)
+
+	# Join the trees in the depth-first order of the part tree, so the anchor of
+	# a part always has its path distance already
+	parents = np.full(len(points), -1)
+	path_distances = np.zeros(len(points))
+	order = []
+	for i in part_order[coarse.dfs_order]:
+		indices = local_indices[i]
+		tree = trees[i]
+		offset = 0.0
+		if anchors[i] >= 0:
+			offset = path_distances[anchors[i]] + np.sqrt(np.sum(np.square(points[entries[i]] - points[anchors[i]])))
+		path_distances[indices] = tree.path_distances + offset
+		parents[indices[1:]] = indices[tree.parents[1:]]
+		parents[indices[0]] = anchors[i]
+		order.append(indices[tree.dfs_order])
+	return np.concatenate(order), parents, path_distances
+
+def _distance_matrix(points, block_bytes):
+	"""Pairwise distances, computed in row blocks of at most block_bytes temporary memory"""
+	length = len(points)
+	distances = np.empty((length, length))
+	block = max(1, block_bytes // max(1, length * points.shape[1] * points.itemsize))
+	for start in range(0, length, block):
+		difference = np.subtract(points[np.newaxis], points[start:start + block, np.newaxis])
+		distances[start:start + block] = np.sqrt(np.sum(np.square(difference, out = difference), axis = 2))
+	return distances
 
-	root_point = points[0]
+def _sweep_engine(distances, balancing_factors):
+	"""Runs the exhaustive loop for several balancing factors on a distance matrix.
 
-	root_node = Node(None, root_point, 0)
-	closed_list[0] = root_node
+	Returns a list of (attach order, parent indices, path distances).
+	"""
+	count = len(balancing_factors)
+	length = len(distances)
+	rows = np.arange(count)
 
-	# Init open points list
-	open_list = [x for x in range(1,length)]
+	parents = np.full((count, length), -1, dtype = int)
+	path_distances = np.zeros((count, length))
+	order = np.zeros((count, length), dtype = int)
+
+	open_distances = np.repeat(distances[:1], count, axis = 0)
+	open_distances[:, 0] = np.inf
+	closed = np.zeros((count, length), dtype = bool)
+	closed[:, 0] = True
+	closest_point_in_tree = np.zeros((count, length), dtype = int)
+	weighted_distance = np.empty((count, length))
+	changed_values = np.empty((count, length), dtype = bool)
+
+	for step in range(1, length):
+		point_index = np.argmin(open_distances, axis = 1)
+		closest_point_index = closest_point_in_tree[rows, point_index]
+
+		path_distance = distances[point_index, closest_point_index] + path_distances[rows, closest_point_index]
+		parents[rows, point_index] = closest_point_index
+		path_distances[rows, point_index] = path_distance
+		order[:, step] = point_index
+
+		closed[rows, point_index] = True
+		open_distances[rows, point_index] = np.inf
+
+		np.take(distances, point_index, axis = 0, out = weighted_distance)
+		weighted_distance += (balancing_factors * path_distance)[:, np.newaxis]
+		np.copyto(weighted_distance, np.inf, where = closed)
+		np.less(weighted_distance, open_distances, out = changed_values)
+		np.minimum(open_distances, weighted_distance, out = open_distances)
+		np.copyto(closest_point_in_tree, point_index[:, np.newaxis], where = changed_values)
+
+	return [(order[i], parents[i], path_distances[i]) for i in range(count)]
+
+def _exhaustive_engine(points, balancing_factor, progress = None):
+	"""Updates the distance of every open point to the tree on every step.
+
+	The open points are kept in preallocated buffers that are updated in place.
+	A closed point is not removed right away, its location is moved to infinity
+	so it never gets closer to the tree. Once a quarter of the buffer is closed,
+	the open points are moved to the front again, keeping their order.
+
+	Returns the attach order, the parent index of every point (-1 for the root)
+	and the path distances.
+	"""
+	length = len(points)
+
+	parents = np.full(length, -1, dtype = int)
+	path_distances = np.zeros(length)
+	order = np.empty(length, dtype = int)
+	order[0] = 0
+
+	# Init open points buffers
+	open_list = np.arange(1, length)
+	open_points = points[1:].copy()
+	size = length - 1
+	closed_count = 0
 
 	# Init distance to root_point
-	distances_squared = np.sum(np.square(points - root_point), axis = 1)
-	distances = np.empty(length)
-	for i in range(length - 1):
-		distances[i] = np.sqrt(distances_squared[i])
+	open_distance_list = np.sqrt(np.sum(np.square(open_points - points[0]), axis = 1))
+	closest_point_in_tree = np.zeros(size, dtype = int)
 
-	closest_point_in_tree = np.zeros(length, dtype = int)
-	
-	distances = np.sqrt(distances_squared)
+	# Scratch buffers for the distance update
+	difference = np.empty_like(open_points)
+	weighted_distance = np.empty_like(open_distance_list)
+	changed_values = np.empty(size, dtype = bool)
 
-	open_distance_list = distances.copy()[1:]
-	
-	while len(open_distance_list) > 0:
-		minimum_index = np.argmin(open_distance_list)
-		minimum = open_distance_list[minimum_index]
-		point_index = open_list.pop(minimum_index)
+	for step in range(1, length):
+		minimum_index = np.argmin(open_distance_list[:size])
+		point_index = open_list[minimum_index]
 
 		# Get closest point and append new node to it
-		closest_point_index = closest_point_in_tree[point_index]
+		closest_point_index = closest_point_in_tree[minimum_index]
 
 		location = points[point_index]
 
-		parent_node = closed_list[closest_point_index]
-		actual_distance = np.sqrt(np.sum(np.square(location - parent_node.pos)))
-		path_distance = actual_distance + parent_node.path_distance
-		node = Node(parent_node, location, point_index, path_distance)
-		
+		actual_distance = np.sqrt(np.sum(np.square(location - points[closest_point_index])))
+		path_distance = actual_distance + path_distances[closest_point_index]
+
 		# Add to closed list
-		closed_list[point_index] = node
+		parents[point_index] = closest_point_index
+		path_distances[point_index] = path_distance
+		order[step] = point_index
+
 		# Remove from open list
-		open_distance_list = np.delete(open_distance_list, minimum_index)
+		open_points[minimum_index] = np.inf
+		open_distance_list[minimum_index] = np.inf
+		closed_count += 1
+		if closed_count * 4 > size:
+			keep = np.isfinite(open_distance_list[:size])
+			new_size = size - closed_count
+			open_list[:new_size] = open_list[:size][keep]
+			open_points[:new_size] = open_points[:size][keep]
+			open_distance_list[:new_size] = open_distance_list[:size][keep]
+			closest_point_in_tree[:new_size] = closest_point_in_tree[:size][keep]
+			size = new_size
+			closed_count = 0
+
+		d = difference[:size]
+		w = weighted_distance[:size]
+		changed = changed_values[:size]
+		np.subtract(open_points[:size], location, out = d)
+		np.square(d, out = d)
+		np.sum(d, axis = 1, out = w)
+		np.sqrt(w, out = w)
+		w += balancing_factor * path_distance
+		np.less(w, open_distance_list[:size], out = changed)
+		np.minimum(open_distance_list[:size], w, out = open_distance_list[:size])
+		np.copyto(closest_point_in_tree[:size], point_index, where = changed)
+
+		if progress is not None and step % PROGRESS_INTERVAL == 0:
+			progress(step, length)
+
+	return order, parents, path_distances
+
+def _build_nodes(points, order, parents, path_distances):
+	"""Creates the Node graph from the attach order and parent indices of an engine"""
+	nodes = {}
+	parents = parents.tolist()
+	for point_index in order.tolist():
+		parent_index = parents[point_index]
+		parent_node = nodes[parent_index] if parent_index >= 0 else None
+		nodes[point_index] = Node(parent_node, points[point_index], point_index, path_distances[point_index])
+	return nodes[order[0]]
+
+def _grid_engine(points, balancing_factor, points_per_cell = 32, cells_per_block = 2, progress = None):
+	"""Grid accelerated variant of the mstree loop.
+
+	Every grid cell keeps the bounding box of its points together with the
+	smallest and largest weighted distance of its open points. A new node at
+	location x with path distance p can only improve an open point q if
+	|q - x| + balancing_factor * p is smaller than its current distance, so
+	cells whose box is further away than their largest distance are skipped.
+	Blocks of cells_per_block cells along every axis keep the same bounds over
+	their cells, so a step only scans the blocks and then the cells of the
+	blocks that hold the closest open point or are near the new node, instead
+	of all cells. Coordinates are stored per dimension like in _stacked_engine.
+	Ties are resolved like in the exhaustive loop: the open point with the
+	lowest index is attached first and a parent only changes on a strict
+	improvement.
+
+	Returns the attach order, the parent index of every point (-1 for the root)
+	and the path distances.
+	"""
+	length = len(points)
+
+	parents = np.full(length, -1, dtype = int)
+	path_distances = np.zeros(length)
+	order = np.empty(length, dtype = int)
+	order[0] = 0
+
+	# Cell size so that every cell holds about points_per_cell points. Flat
+	# dimensions (e.g. 2D data in 3D space, also with a little jitter) don't
+	# contribute to the volume. A dimension whose extent is below the cell size
+	# fits into one cell, so the size is recomputed without it, which only
+	# makes the cells larger, until no more dimensions become flat.
+	low = points.min(axis = 0)
+	extent = points.max(axis = 0) - low
+	flat = extent <= 0
+	cell_size = 1.0
+	while not flat.all():
+		spread = extent[~flat]
+		cell_size = (np.prod(spread / spread.max()) * points_per_cell / length) ** (1.0 / len(spread)) * spread.max()
+		if not np.any(~flat & (extent < cell_size)):
+			break
+		flat |= extent < cell_size
+	cell_coords = np.floor((points - low) / cell_size).astype(np.int64)
+	cell_ids = np.ravel_multi_index(cell_coords.T, cell_coords.max(axis = 0) + 1)
+	block_coords = cell_coords // cells_per_block
+	block_ids = np.ravel_multi_index(block_coords.T, block_coords.max(axis = 0) + 1)
+
+	# Sort points by block and cell. The points of every cell are stored in CSR
+	# layout, the cells of every block in a padded table. The padding refers to
+	# an extra cell with an empty box and no open points.
+	sorted_points = np.lexsort((cell_ids, block_ids))
+	cell_start = np.flatnonzero(np.diff(cell_ids[sorted_points], prepend = -1) != 0)
+	cell_count = np.diff(np.append(cell_start, length))
+	cell_total = len(cell_start)
+	cell_of_point = np.empty(length, dtype = int)
+	cell_of_point[sorted_points] = np.repeat(np.arange(cell_total), cell_count)
+	cell_min = np.full((points.shape[1], cell_total + 1), np.inf)
+	cell_max = np.full((points.shape[1], cell_total + 1), -np.inf)
+	cell_min[:, :-1] = np.minimum.reduceat(points[sorted_points], cell_start, axis = 0).T
+	cell_max[:, :-1] = np.maximum.reduceat(points[sorted_points], cell_start, axis = 0).T
+
+	block_boundary = np.diff(block_ids[sorted_points[cell_start]], prepend = -1) != 0
+	block_start = np.flatnonzero(block_boundary)
+	block_of_cell = np.cumsum(block_boundary) - 1
+	block_cells = np.full((len(block_start), np.diff(np.append(block_start, cell_total)).max()), cell_total)
+	block_cells[block_of_cell, np.arange(cell_total) - block_start[block_of_cell]] = np.arange(cell_total)
+	block_min = cell_min[:, block_cells].min(axis = 2)
+	block_max = cell_max[:, block_cells].max(axis = 2)
+
+	# Init distance to root_point
+	coordinates = np.ascontiguousarray(points.T)
+	distances = np.sqrt(np.sum(np.square(points - points[0]), axis = 1))
+	closest_point_in_tree = np.zeros(length, dtype = int)
+	closed = np.zeros(length, dtype = bool)
+	closed[0] = True
+
+	def cell_members(cells):
+		"""Returns the points of the given cells and the offset of every cell in that list"""
+		counts = cell_count.take(cells)
+		offsets = np.cumsum(counts) - counts
+		return sorted_points.take(np.repeat(cell_start.take(cells) - offsets, counts) + np.arange(offsets[-1] + counts[-1])), offsets
+
+	def near(location, offset, box_min, box_max, upper):
+		"""Returns a mask of the boxes, given per dimension, that are closer to location than upper - offset"""
+		gap = np.maximum(box_min - location[:, np.newaxis], location[:, np.newaxis] - box_max)
+		np.maximum(gap, 0, out = gap)
+		squared = np.sum(np.square(gap, out = gap), axis = 0)
+		return (np.sqrt(squared, out = squared) + offset) * (1 - 1e-9) < upper
+
+	def update_bounds(cells, members, offsets):
+		"""Recalculates the lowest and highest distance of the open points in the given cells and their blocks"""
+		member_distances = distances.take(members)
+		member_closed = closed.take(members)
+		cell_lower[cells] = np.minimum.reduceat(np.where(member_closed, np.inf, member_distances), offsets)
+		cell_upper[cells] = np.maximum.reduceat(np.where(member_closed, -np.inf, member_distances), offsets)
+		blocks = block_of_cell.take(cells)
+		block_rows = block_cells.take(blocks, axis = 0)
+		block_lower[blocks] = cell_lower.take(block_rows).min(axis = 1)
+		block_upper[blocks] = cell_upper.take(block_rows).max(axis = 1)
+
+	cell_lower = np.full(cell_total + 1, np.inf)
+	cell_upper = np.full(cell_total + 1, -np.inf)
+	block_lower = np.empty(len(block_start))
+	block_upper = np.empty(len(block_start))
+	update_bounds(np.arange(cell_total), sorted_points, cell_start)
+
+	for step in range(1, length):
+		if progress is not None and step % PROGRESS_INTERVAL == 0:
+			progress(step, length)
+
+		# Find the open point with the lowest distance and the lowest index
+		minimum = block_lower.min()
+		cells = block_cells.take(np.flatnonzero(block_lower == minimum), axis = 0).ravel()
+		members = cell_members(cells[cell_lower.take(cells) == minimum])[0]
+		point_index = members[(distances.take(members) == minimum) & ~closed.take(members)].min()
+
+		parent_index = closest_point_in_tree[point_index]
+		location = coordinates[:, point_index]
+		actual_distance = np.sqrt(np.sum(np.square(points[point_index] - points[parent_index])))
+		path_distance = actual_distance + path_distances[parent_index]
+		parents[point_index] = parent_index
+		path_distances[point_index] = path_distance
+		order[step] = point_index
+		closed[point_index] = True
+
+		# Only visit blocks and cells that can contain a point that gets closer,
+		# the cell of the new node always gets new bounds
+		offset = balancing_factor * path_distance
+		blocks = np.flatnonzero(near(location, offset, block_min, block_max, block_upper))
+		cells = block_cells.take(blocks, axis = 0).ravel()
+		cells = cells[near(location, offset, cell_min.take(cells, axis = 1), cell_max.take(cells, axis = 1), cell_upper.take(cells))]
+		cells = np.append(cells, cell_of_point[point_index])
+		members, offsets = cell_members(cells)
+
+		difference = coordinates.take(members, axis = 1)
+		difference -= location[:, np.newaxis]
+		np.square(difference, out = difference)
+		weighted_distance = np.sum(difference, axis = 0)
+		np.sqrt(weighted_distance, out = weighted_distance)
+		weighted_distance += offset
+		changed = weighted_distance < distances.take(members)
+		changed &= ~closed.take(members)
+		distances[members[changed]] = weighted_distance[changed]
+		closest_point_in_tree[members[changed]] = point_index
+		update_bounds(cells, members, offsets)
+
+	return order, parents, path_distances
+
+def _stacked_engine(point_clouds, balancing_factors, progress = None):
+	"""Runs the exhaustive loop for several point clouds at once.
+
+	The clouds are padded with points at infinity, which never get closer to a
+	tree. point_clouds must be sorted by size, largest first, so the trees that
+	still have open points are always the first rows. Coordinates are stored
+	per dimension, which makes the squared distances plain array additions.
+	progress is called as progress(attached, total) with the attached points
+	of all clouds, every PROGRESS_INTERVAL points.
+
+	Returns a list of (attach order, parent indices, path distances).
+	"""
+	count = len(point_clouds)
+	lengths = np.array([len(points) for points in point_clouds])
+	length = lengths[0]
+	dimensions = point_clouds[0].shape[1]
+
+	points = np.full((dimensions, count, length), np.inf)
+	for i, cloud in enumerate(point_clouds):
+		points[:, i, :len(cloud)] = cloud.T
+
+	parents = np.full((count, length), -1, dtype = int)
+	path_distances = np.zeros((count, length))
+	order = np.zeros((count, length), dtype = int)
+
+	# Closed and padding points are at infinity
+	open_points = points.copy()
+	open_points[:, :, 0] = np.inf
+	difference = np.empty((count, length))
+	distances = np.zeros((count, length))
+	for dimension in range(dimensions):
+		np.subtract(open_points[dimension], points[dimension, :, :1], out = difference)
+		distances += np.square(difference, out = difference)
+	np.sqrt(distances, out = distances)
+	closest_point_in_tree = np.zeros((count, length), dtype = int)
+	weighted_distance = np.empty((count, length))
+
+	# Every step attaches one point to each tree that still has open points
+	total = int(lengths.sum())
+	attached = reported = count
+	for step in range(1, length):
+		active = np.count_nonzero(lengths > step)
+		rows = np.arange(active)
+		if progress is not None and attached - reported >= PROGRESS_INTERVAL:
+			progress(attached, total)
+			reported = attached
+		attached += int(active)
+
+		point_index = np.argmin(distances[:active], axis = 1)
+		closest_point_index = closest_point_in_tree[rows, point_index]
+		location = points[:, rows, point_index]
+
+		actual_distance = np.sqrt(np.sum(np.square(location - points[:, rows, closest_point_index]), axis = 0))
+		path_distance = actual_distance + path_distances[rows, closest_point_index]
+		parents[rows, point_index] = closest_point_index
+		path_distances[rows, point_index] = path_distance
+		order[rows, step] = point_index
+
+		open_points[:, rows, point_index] = np.inf
+		distances[rows, point_index] = np.inf
 
-		open_points = points[open_list]
-		weighted_distance = np.sqrt(np.sum(np.square(np.subtract(open_points, location)), axis = 1)) + balancing_factor * path_distance
-		open_distance_list_indeces = np.argmin(np.column_stack((open_distance_list, weighted_distance)), axis = 1)
-		open_distance_list = np.minimum(open_distance_list, weighted_distance)
-		changed_values = np.zeros(len(closest_point_in_tree), dtype = bool)
-		changed_values.put(open_list, open_distance_list_indeces)
-		closest_point_in_tree = np.where(changed_values == 1, point_index, closest_point_in_tree)
+		w = weighted_distance[:active]
+		d = difference[:active]
+		w.fill(0)
+		for dimension in range(dimensions):
+			np.subtract(open_points[dimension, :active], location[dimension, :, np.newaxis], out = d)
+			w += np.square(d, out = d)
+		np.sqrt(w, out = w)
+		w += (balancing_factors[:active] * path_distance)[:, np.newaxis]
+		changed_values = w < distances[:active]
+		np.minimum(distances[:active], w, out = distances[:active])
+		np.copyto(closest_point_in_tree[:active], point_index[:, np.newaxis], where = changed_values)
 
-	return root_node
+	return [(order[i, :lengths[i]], parents[i, :lengths[i]], path_distances[i, :lengths[i]]) for i in range(count)]
 
 def tree_to_list(root_node):
-	"""Orders the nodes into a list recursivly using depth-first-search"""
-	ls = [root_node]
-	for child in root_node.children:
-		ls.extend(tree_to_list(child))
-	return ls
+	"""Orders the nodes into a list using depth-first-search"""
+	return list(traversal.pre_order(root_node))
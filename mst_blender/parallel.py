@@ -0,0 +1,79 @@
+"""Computes trees in worker processes.
+
+This module only depends on numpy and the tree modules, so the workers don't
+need Blender. Processes are started with the 'spawn' method since forking a
+running Blender is not safe.
+"""
+from . import mstree
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import multiprocessing
+import os
+
+POLL_SECONDS = 0.1
+
+def completed(function, arguments, processes, poll = None):
+	"""Calls function(*arguments[i]) for every i in a process pool and yields
+	(i, result) as the calls finish.
+
+	With a single process the calls run one after another in the calling
+	process. poll is called every POLL_SECONDS while waiting and can stop the
+	work by raising. When the loop over the results is left early, pending calls
+	are cancelled and the pool is shut down without waiting for running calls.
+	"""
+	arguments = list(arguments)
+	if processes <= 1:
+		for i, args in enumerate(arguments):
+			yield i, function(*args)
+		return
+
+	pool = ProcessPoolExecutor(max_workers = processes, mp_context = multiprocessing.get_context('spawn'))
+	futures = {}
+	try:
+		futures = {pool.submit(function, *args): i for i, args in enumerate(arguments)}
+		pending = set(futures)
+		while pending:
+			finished, pending = wait(pending, timeout = POLL_SECONDS, return_when = FIRST_COMPLETED)
+			for future in finished:
+				yield futures[future], future.result()
+			if poll is not None and pending:
+				poll()
+	finally:
+		for future in futures:
+			future.cancel()
+		pool.shutdown(wait = all(future.done() for future in futures))
+
+def _build_batch(point_clouds, balancing_factors):
+	return mstree.mstree_batch(point_clouds, balancing_factors, compact = True)
+
+def build_batches(point_clouds, balancing_factors, processes = None, progress = None):
+	"""Splits the point clouds into batches and computes them with
+	mstree.mstree_batch in a process pool. Returns the ArrayTrees in input order.
+
+	progress is called as progress(done, total) with the number of points of the
+	finished batches, also while waiting, so raising in it stops the work.
+	"""
+	if processes is None or processes < 1:
+		processes = os.cpu_count() or 1
+	processes = max(1, min(processes, len(point_clouds)))
+
+	# Several batches per process, dealt out by size so they get a similar
+	# amount of work and progress is reported in small steps
+	batch_count = max(1, min(len(point_clouds), processes * 4))
+	by_size = sorted(range(len(point_clouds)), key = lambda i: -len(point_clouds[i]))
+	batches = [by_size[i::batch_count] for i in range(batch_count)]
+
+	total = sum(len(points) for points in point_clouds)
+	done = 0
+	poll = None
+	if progress is not None:
+		poll = lambda: progress(done, total)
+
+	trees = [None] * len(point_clouds)
+	arguments = [([point_clouds[i] for i in batch], balancing_factors[batch]) for batch in batches]
+	for b, batch_trees in completed(_build_batch, arguments, processes, poll):
+		for i, tree in zip(batches[b], batch_trees):
+			trees[i] = tree
+		done += sum(len(point_clouds[i]) for i in batches[b])
+		if progress is not None:
+			progress(done, total)
+	return trees
@@ -0,0 +1,137 @@
+"""Error bounded simplification of trees for building lighter geometry.
+
+Long unbranched chains of nearly collinear nodes are collapsed. The root,
+branch points and tips are always kept; the other nodes of every chain are
+reduced with the Douglas-Peucker algorithm, so every removed node is at most
+max_error away from the simplified segment and, if the tree has thickness, its
+thickness differs at most thickness_error from the thickness interpolated
+along the segment. All chains are split in the same vectorized passes, one
+pass per level of the Douglas-Peucker recursion.
+
+The kept nodes keep their positions, path distances and thickness, so the
+simplified tree can be built like any other tree.
+"""
+from . import mstree
+import numpy as np
+
+def _scaled_error(error, tolerance):
+	"""Returns the error in multiples of the tolerance, a zero tolerance allows no error"""
+	if tolerance > 0:
+		return error / tolerance
+	return np.where(error > 0, np.inf, 0.0)
+
+def simplify_mask(tree, max_error, thickness_error = None):
+	"""Returns a boolean mask of the nodes of an ArrayTree that simplify_tree keeps"""
+	child_counts = np.diff(tree.child_offsets)
+	keep = child_counts != 1
+	keep[tree.dfs_order[0]] = True
+
+	# A node with one child is directly followed by it in dfs_order, so the
+	# removable nodes form runs there. Every run goes from its first node's
+	# parent to the node after its last node, both of which are kept.
+	order = tree.dfs_order
+	removable = ~keep[order]
+	positions = np.flatnonzero(removable)
+	if len(positions) == 0:
+		return keep
+	run_starts = np.flatnonzero(np.diff(positions, prepend = -2) != 1)
+	run_lengths = np.diff(np.append(run_starts, len(positions)))
+	starts = np.repeat(tree.parents[order[positions[run_starts]]], run_lengths)
+	ends = np.repeat(order[positions[run_starts] + run_lengths], run_lengths)
+	nodes = order[positions]
+
+	coordinates = tree.positions
+	use_thickness = thickness_error is not None and tree.thickness is not None
+
+	# Every pass finds the worst node of every segment. Segments within the
+	# tolerance drop all their nodes, the others are split at their worst node.
+	while len(nodes):
+		a = coordinates[starts]
+		direction = coordinates[ends] - a
+		offset = coordinates[nodes] - a
+		squared = np.sum(np.square(direction), axis = 1)
+		t = np.divide(np.sum(offset * direction, axis = 1), squared, out = np.zeros(len(nodes)), where = squared > 0)
+		np.clip(t, 0.0, 1.0, out = t)
+		distance = np.sqrt(np.sum(np.square(offset - t[:, np.newaxis] * direction), axis = 1))
+		error = _scaled_error(distance, max_error)
+		if use_thickness:
+			thickness = tree.thickness
+			interpolated = thickness[starts] + t * (thickness[ends] - thickness[starts])
+			error = np.maximum(error, _scaled_error(np.abs(thickness[nodes] - interpolated), thickness_error))
+
+		# The nodes of a segment are contiguous, segments differ in their start or end
+		boundary = np.ones(len(nodes), dtype = bool)
+		boundary[1:] = (starts[1:] != starts[:-1]) | (ends[1:] != ends[:-1])
+		segment_starts = np.flatnonzero(boundary)
+		segment_ids = np.cumsum(boundary) - 1
+		worst_error = np.maximum.reduceat(error, segment_starts)
+		candidates = np.flatnonzero(error == worst_error[segment_ids])
+		worst = candidates[np.unique(segment_ids[candidates], return_index = True)[1]]
+		split = worst_error > 1.0
+
+		split_points = worst[split]
+		keep[nodes[split_points]] = True
+
+		# Nodes before a split point end at it, nodes after it start at it
+		split_node = np.full(len(segment_starts), -1)
+		split_node[split] = nodes[split_points]
+		split_position = np.full(len(segment_starts), -1)
+		split_position[split] = split_points
+		index = np.arange(len(nodes))
+		own_split = split_position[segment_ids]
+		before = index < own_split
+		after = (own_split >= 0) & (index > own_split)
+		ends = np.where(before, split_node[segment_ids], ends)
+		starts = np.where(after, split_node[segment_ids], starts)
+		remaining = before | after
+		nodes, starts, ends = nodes[remaining], starts[remaining], ends[remaining]
+
+	return keep
+
+def simplify_tree(tree, max_error, thickness_error = None):
+	"""Returns a simplified copy of a tree and the original indices of its nodes.
+
+	tree can be an ArrayTree or the root Node of a tree, the result is an
+	ArrayTree in which node i is node indices[i] of the original tree.
+	"""
+	if not isinstance(tree, mstree.ArrayTree):
+		tree = mstree.ArrayTree.from_nodes(tree)
+
+	keep = simplify_mask(tree, max_error, thickness_error)
+	indices = np.flatnonzero(keep)
+	new_index = np.full(len(tree), -1)
+	new_index[indices] = np.arange(len(indices))
+
+	# The parent of a kept node is the closest kept node before it in dfs_order
+	# within the same run of nodes with one child, or the parent of that run
+	order = tree.dfs_order
+	kept_order = keep[order]
+	single_child = np.diff(tree.child_offsets)[order] == 1
+	run_start = single_child & ~np.concatenate(([False], single_child[:-1]))
+	run_first = np.maximum.accumulate(np.where(run_start, np.arange(len(order)), 0))
+	last_kept = np.maximum.accumulate(np.where(kept_order, np.arange(len(order)), 0))
+	parents = np.full(len(tree), -1)
+	positions = np.flatnonzero(kept_order[1:]) + 1
+	parent = tree.parents[order[positions]]
+	removed = ~keep[parent]
+	previous = positions[removed] - 1
+	parent[removed] = np.where(last_kept[previous] >= run_first[previous], order[last_kept[previous]], tree.parents[order[run_first[previous]]])
+	parents[order[positions]] = parent
+
+	parents = parents[indices]
+	parents[parents >= 0] = new_index[parents[parents >= 0]]
+	simplified = mstree.ArrayTree(tree.positions[indices], parents, tree.path_distances[indices], new_index[order[kept_order]])
+	if tree.thickness is not None:
+		simplified.thickness = tree.thickness[indices]
+	return simplified, indices
+
+def lod_levels(tree, max_errors, thickness_errors = None):
+	"""Returns one simplified tree per error, e.g. for levels of detail.
+
+	thickness_errors is None or a sequence of the same length as max_errors.
+	"""
+	if not isinstance(tree, mstree.ArrayTree):
+		tree = mstree.ArrayTree.from_nodes(tree)
+	if thickness_errors is None:
+		thickness_errors = [None] * len(max_errors)
+	return [simplify_tree(tree, max_error, thickness_error)[0] for max_error, thickness_error in zip(max_errors, thickness_errors)]
@@ -0,0 +1,87 @@
+"""Timing of the stages of tree creation.
+
+A StageStats collector is passed through tree creation and records the wall
+time, optional peak memory and counts like points or nodes for every stage:
+
+	stats = StageStats()
+	with stats.stage('mstree', points = len(points)) as record:
+		tree = mstree.mstree(points, compact = True)
+		record['nodes'] = len(tree)
+	print(stats.summary())
+
+Stages that run more than once, like the trees of a dendrite batch, are added
+up in totals().
+"""
+from collections import OrderedDict
+from contextlib import contextmanager
+import tracemalloc
+import time
+import json
+
+class StageStats:
+	"""Records wall time, counts and with trace_memory the peak memory of stages.
+
+	Peak memory is measured with tracemalloc, which slows down allocations, so
+	it is off by default.
+	"""
+	def __init__(self, trace_memory = False):
+		self.trace_memory = trace_memory
+		self.records = []
+
+	@contextmanager
+	def stage(self, name, **counts):
+		"""Times the block and adds a record for it, the yielded record takes more counts"""
+		record = {'stage': name}
+		record.update(counts)
+		tracing = self.trace_memory and not tracemalloc.is_tracing()
+		if tracing:
+			tracemalloc.start()
+		elif self.trace_memory and hasattr(tracemalloc, 'reset_peak'):
+			tracemalloc.reset_peak()
+		if self.trace_memory:
+			start_memory = tracemalloc.get_traced_memory()[0]
+		start = time.perf_counter()
+		try:
+			yield record
+		finally:
+			record['seconds'] = time.perf_counter() - start
+			if self.trace_memory:
+				record['peak_memory'] = max(0, tracemalloc.get_traced_memory()[1] - start_memory)
+			if tracing:
+				tracemalloc.stop()
+			self.records.append(record)
+
+	def totals(self):
+		"""Returns the records added up per stage, in the order stages first ran"""
+		totals = OrderedDict()
+		for record in self.records:
+			total = totals.setdefault(record['stage'], {'calls': 0})
+			total['calls'] += 1
+			for key, value in record.items():
+				if key == 'stage':
+					continue
+				if key == 'peak_memory':
+					total[key] = max(total.get(key, 0), value)
+				elif isinstance(value, (int, float)) and not isinstance(value, bool):
+					total[key] = total.get(key, 0) + value
+		return totals
+
+	def summary(self):
+		"""Returns a one line summary of the totals, e.g. for an operator report"""
+		parts = []
+		for name, total in self.totals().items():
+			part = '%s %.3f s' % (name, total['seconds'])
+			if total['calls'] > 1:
+				part += ' (%dx)' % total['calls']
+			if 'peak_memory' in total:
+				part += ' %.1f MB' % (total['peak_memory'] / 2**20)
+			parts.append(part)
+		return ', '.join(parts)
+
+	def to_json(self):
+		"""Returns the records and totals as JSON string"""
+		return json.dumps({'records': self.records, 'totals': self.totals()}, indent = 1)
+
+	def write(self, path):
+		with open(path, 'w') as f:
+			f.write(self.to_json())
@@ -0,0 +1,63 @@
+"""Iterative traversal orders for Node trees.
+
+The orders are computed without recursion, so long unbranched chains don't hit
+Python's recursion limit. pre_order, post_order and breadth_first cache their
+result on the root node, call clear_cache after changing the tree.
+"""
+from collections import deque
+
+_CACHE_ATTRIBUTE = '_traversal_orders'
+
+def iter_pre_order(root_node):
+	"""Yields the nodes depth-first, parents before their children"""
+	stack = [root_node]
+	while stack:
+		node = stack.pop()
+		yield node
+		stack.extend(reversed(node.children))
+
+def iter_post_order(root_node):
+	"""Yields the nodes depth-first, children before their parents"""
+	stack = [(root_node, iter(root_node.children))]
+	while stack:
+		node, children = stack[-1]
+		child = next(children, None)
+		if child is None:
+			stack.pop()
+			yield node
+		else:
+			stack.append((child, iter(child.children)))
+
+def iter_breadth_first(root_node):
+	"""Yields the nodes level by level"""
+	queue = deque([root_node])
+	while queue:
+		node = queue.popleft()
+		yield node
+		queue.extend(node.children)
+
+def _cached(root_node, name, iterate):
+	orders = getattr(root_node, _CACHE_ATTRIBUTE, None)
+	if orders is None:
+		orders = {}
+		setattr(root_node, _CACHE_ATTRIBUTE, orders)
+	if name not in orders:
+		orders[name] = list(iterate(root_node))
+	return orders[name]
+
+def pre_order(root_node):
+	"""Returns the cached depth-first pre-order list, don't modify it"""
+	return _cached(root_node, 'pre', iter_pre_order)
+
+def post_order(root_node):
+	"""Returns the cached depth-first post-order list, don't modify it"""
+	return _cached(root_node, 'post', iter_post_order)
+
+def breadth_first(root_node):
+	"""Returns the cached breadth-first list, don't modify it"""
+	return _cached(root_node, 'bfs', iter_breadth_first)
+
+def clear_cache(root_node):
+	"""Drops the cached orders of a tree"""
+	if hasattr(root_node, _CACHE_ATTRIBUTE):
+		delattr(root_node, _CACHE_ATTRIBUTE)
@@ -0,0 +1,79 @@
+"""Reading point clouds and writing trees to files.
+
+Point clouds can be read from .npy files (memory-mapped), .npz files and
+delimited text files. Trees are written in bulk to the SWC neuron format or to
+a compact .npz file. Nothing here needs Blender.
+"""
+from . import mstree
+import numpy as np
+import os
+
+SWC_SOMA = 1
+SWC_BASAL_DENDRITE = 3
+
+def load_points(path, delimiter = None, mmap = True):
+	"""Reads an (n, dimensions) point array.
+
+	.npy files are memory-mapped unless mmap is False. .npz files must contain
+	a 'points' array or a single array. Other files are read as delimited text;
+	without a delimiter ';', ',' and whitespace are detected from the first line.
+	"""
+	extension = os.path.splitext(path)[1].lower()
+	if extension == '.npy':
+		return np.load(path, mmap_mode = 'r' if mmap else None)
+	if extension == '.npz':
+		with np.load(path) as arrays:
+			if 'points' in arrays:
+				return arrays['points']
+			if len(arrays.files) != 1:
+				raise ValueError("%s needs a 'points' array or a single array" % path)
+			return arrays[arrays.files[0]]
+
+	if delimiter is None:
+		with open(path, 'r') as f:
+			line = f.readline()
+		delimiter = ';' if ';' in line else ',' if ',' in line else None
+	return np.loadtxt(path, delimiter = delimiter, ndmin = 2)
+
+def write_swc(path, tree, radius = 1.0, path_scale = 1.0, root_type = SWC_SOMA, node_type = SWC_BASAL_DENDRITE):
+	"""Writes a tree in the SWC format.
+
+	Nodes are written in depth-first order, so every parent comes before its
+	children. The radius is half of the thickness from add_quad_diameter, or
+	the given radius if the tree has no thickness. The thickness is in the
+	units of path_distance * path_scale, pass the path_scale it was computed
+	with to get the radius in the units of the coordinates, like the
+	0.005 * thickness the addon renders at the default path_scale of 100.
+	2D trees get z = 0.
+	"""
+	if not isinstance(tree, mstree.ArrayTree):
+		tree = mstree.ArrayTree.from_nodes(tree)
+
+	order = tree.dfs_order
+	length = len(order)
+	sample = np.empty(length, dtype = int)
+	sample[order] = np.arange(1, length + 1)
+
+	table = np.zeros((length, 7))
+	table[:, 0] = np.arange(1, length + 1)
+	table[:, 1] = node_type
+	table[0, 1] = root_type
+	dimensions = min(3, tree.positions.shape[1])
+	table[:, 2:2 + dimensions] = tree.positions[order, :dimensions]
+	table[:, 5] = tree.thickness[order] / (2 * path_scale) if tree.thickness is not None else radius
+	parents = tree.parents[order]
+	table[:, 6] = np.where(parents >= 0, sample[np.maximum(parents, 0)], -1)
+
+	np.savetxt(path, table, fmt = ['%d', '%d', '%.8g', '%.8g', '%.8g', '%.8g', '%d'], delimiter = ' ',
+		header = 'SWC written by mst_blender\nn T x y z R P')
+
+def save_tree(path, tree):
+	"""Writes all arrays of a tree to a compressed .npz file"""
+	if not isinstance(tree, mstree.ArrayTree):
+		tree = mstree.ArrayTree.from_nodes(tree)
+	np.savez_compressed(path, **tree.to_arrays())
+
+def load_tree(path):
+	"""Reads a tree written by save_tree"""
+	with np.load(path) as arrays:
+		return mstree.ArrayTree.from_arrays(dict(arrays))
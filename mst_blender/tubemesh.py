@@ -0,0 +1,82 @@
+"""Tube geometry of a tree as flat arrays, for building meshes without the Skin modifier.
+
+The tree is split into unbranched paths with ArrayTree.paths, like the curves
+built from it. Every node of a path gets a ring of vertices perpendicular to
+the path, and neighbouring rings are joined with quads. Side branches start
+with a ring at their branch point, inside the tube of the parent path, which
+joins them without any boolean operations. Tips and the root are closed with
+an n-gon.
+
+Ring orientations are derived from a fixed reference axis per ring, and the
+quads between two rings connect the vertices with the closest angles, so the
+tubes don't twist even though the frames are not transported along the path.
+"""
+from . import mstree
+import numpy as np
+
+def _normalize(vectors, fallback):
+	length = np.linalg.norm(vectors, axis = 1, keepdims = True)
+	return np.where(length > 0, vectors / np.where(length > 0, length, 1), fallback)
+
+def tube_mesh(tree, resolution = 8, radius = 0.005):
+	"""Returns the tube geometry of a tree.
+
+	The radius of a node is its thickness times radius, or radius if the tree
+	has no thickness. resolution is the number of vertices per ring.
+
+	Returns the vertices (n, 3), the polygon loop starts and totals, and the
+	vertex index of every loop, ready for foreach_set.
+	"""
+	if not isinstance(tree, mstree.ArrayTree):
+		tree = mstree.ArrayTree.from_nodes(tree)
+	resolution = max(3, int(resolution))
+
+	nodes, boundaries = tree.paths()
+	rings = len(nodes)
+	positions = np.zeros((rings, 3))
+	positions[:, :tree.positions.shape[1]] = tree.positions[nodes]
+	radii = np.full(rings, float(radius))
+	if tree.thickness is not None:
+		radii *= tree.thickness[nodes]
+
+	# Tangents are central differences inside a path and one sided at its ends
+	first = np.zeros(rings, dtype = bool)
+	first[boundaries[:-1]] = True
+	last = np.zeros(rings, dtype = bool)
+	last[boundaries[1:] - 1] = True
+	following = np.where(last, np.arange(rings), np.arange(rings) + 1)
+	preceding = np.where(first, np.arange(rings), np.arange(rings) - 1)
+	tangents = _normalize(positions[np.minimum(following, rings - 1)] - positions[preceding], np.array([0.0, 0.0, 1.0]))
+
+	# Ring frames from a reference axis that is not parallel to the tangent
+	reference = np.where(np.abs(tangents[:, 2:]) < 0.9, [0.0, 0.0, 1.0], [1.0, 0.0, 0.0])
+	u = _normalize(np.cross(tangents, reference), np.array([1.0, 0.0, 0.0]))
+	v = np.cross(tangents, u)
+
+	step = 2 * np.pi / resolution
+	angles = np.arange(resolution) * step
+	vertices = positions[:, np.newaxis] + radii[:, np.newaxis, np.newaxis] * (np.cos(angles)[:, np.newaxis] * u[:, np.newaxis] + np.sin(angles)[:, np.newaxis] * v[:, np.newaxis])
+
+	# Quads between neighbouring rings of a path, vertex k of ring a is joined
+	# with the vertex of ring b at the closest angle
+	a = np.flatnonzero(~last)
+	b = a + 1
+	shift = np.rint(np.arctan2(np.sum(u[b] * v[a], axis = 1), np.sum(u[b] * u[a], axis = 1)) / step).astype(int)
+	k = np.arange(resolution)
+	quads = np.empty((len(a), resolution, 4), dtype = np.int64)
+	quads[:, :, 0] = a[:, np.newaxis] * resolution + k
+	quads[:, :, 1] = a[:, np.newaxis] * resolution + (k + 1) % resolution
+	quads[:, :, 2] = b[:, np.newaxis] * resolution + (k + 1 - shift[:, np.newaxis]) % resolution
+	quads[:, :, 3] = b[:, np.newaxis] * resolution + (k - shift[:, np.newaxis]) % resolution
+
+	# Caps at the tips and the root, the root cap faces backwards
+	tips = np.flatnonzero(last)
+	caps = tips[:, np.newaxis] * resolution + k
+	root_cap = (boundaries[0] * resolution + k[::-1])[np.newaxis]
+	if rings == 1:
+		root_cap = root_cap[:0]
+
+	loops = np.concatenate((quads.ravel(), caps.ravel(), root_cap.ravel()))
+	totals = np.concatenate((np.full(quads.shape[0] * resolution, 4), np.full(len(tips) + len(root_cap), resolution)))
+	starts = np.concatenate(([0], np.cumsum(totals)[:-1]))
+	return vertices.reshape(-1, 3), starts, totals, loops
@@ -0,0 +1,170 @@
+"""Benchmarks for mstree, add_quad_diameter and tree_to_list.
+
+Runs without Blender. All point clouds are generated from fixed seeds, so the
+results of every case are reproducible. For every case the best time of a few
+runs and the peak memory (measured with tracemalloc in a separate run) are
+reported, followed by the scaling exponent of every series.
+
+Usage:
+	python tests/benchmark.py                  compare against the stored baseline
+	python tests/benchmark.py --save-baseline  store the current results as baseline
+	python tests/benchmark.py --quick          only the smallest sizes
+
+The run fails if a case is slower or uses more memory than the baseline by
+more than the tolerance, or if the tree it computes changed. Slowdowns below
+the noise floor (--min-seconds) are ignored, the small cases only take a
+fraction of a millisecond. Timings depend on the machine, so the baseline
+should be saved on the machine that compares.
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy as np
+from mst_blender import mstree
+from mst_blender import diameter
+from mst_blender import traversal
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+
+SIZES = [1000, 2000, 4000, 8000]
+QUICK_SIZES = [500, 1000]
+DIMENSIONS = [2, 3]
+BALANCING_FACTORS = [0.0, 0.5]
+ENGINES = ['exhaustive', 'grid']
+
+def make_points(count, dimensions, seed = 0):
+	"""Uniform point cloud in [-5, 5] with the root in the center"""
+	points = np.random.default_rng(seed).random((count, dimensions)) * 10 - 5
+	points[0] = 0
+	return points
+
+def make_nearly_flat_points(count, seed = 0):
+	"""Points on a plane with a little jitter across it, like particles on a plane"""
+	points = make_points(count, 3, seed)
+	points[:, 2] = np.random.default_rng(seed + 1).normal(0, 1e-7, count)
+	return points
+
+def measure(function, repeat):
+	"""Returns the result, the best time of repeat runs and the peak memory in bytes"""
+	best = math.inf
+	for _ in range(repeat):
+		start = time.perf_counter()
+		result = function()
+		best = min(best, time.perf_counter() - start)
+
+	tracemalloc.start()
+	function()
+	peak = tracemalloc.get_traced_memory()[1]
+	tracemalloc.stop()
+	return result, best, peak
+
+def cases(sizes):
+	"""Yields (series, size, function, checksum) for every benchmark case"""
+	for engine in ENGINES:
+		for dimensions in DIMENSIONS:
+			for balancing_factor in BALANCING_FACTORS:
+				series = 'mstree engine=%s dim=%d bf=%.1f' % (engine, dimensions, balancing_factor)
+				for size in sizes:
+					points = make_points(size, dimensions)
+					function = lambda points = points, bf = balancing_factor, engine = engine: mstree.mstree(points, bf, engine = engine, compact = True)
+					yield series, size, function, lambda tree: float(np.sum(tree.path_distances))
+
+	for engine in ENGINES:
+		for size in sizes:
+			points = make_nearly_flat_points(size)
+			function = lambda points = points, engine = engine: mstree.mstree(points, 0.5, engine = engine, compact = True)
+			yield 'mstree engine=%s nearly flat bf=0.5' % engine, size, function, lambda tree: float(np.sum(tree.path_distances))
+
+	for size in sizes:
+		tree = mstree.mstree(make_points(size, 3), 0.5, engine = 'grid', compact = True)
+		function = lambda tree = tree: diameter.add_quad_diameter(tree, 1.0, 0.5, 100.0) or tree
+		yield 'add_quad_diameter', size, function, lambda tree: float(np.sum(tree.thickness))
+
+	for size in sizes:
+		root_node = mstree.mstree(make_points(size, 3), 0.5, engine = 'grid')
+		function = lambda root_node = root_node: traversal.clear_cache(root_node) or mstree.tree_to_list(root_node)
+		yield 'tree_to_list', size, function, lambda nodes: float(sum(node.index for node in nodes))
+
+def run(sizes, repeat):
+	results = {}
+	for series, size, function, checksum in cases(sizes):
+		result, seconds, peak = measure(function, repeat)
+		results['%s n=%d' % (series, size)] = {'series': series, 'size': size, 'seconds': seconds, 'peak_bytes': peak, 'checksum': checksum(result)}
+		print('%-45s n=%-6d %10.4f s %10.1f KiB' % (series, size, seconds, peak / 1024))
+	return results
+
+def report_scaling(results):
+	"""Prints the exponent k of time ~ n^k for every series"""
+	print('\nScaling')
+	series = {}
+	for result in results.values():
+		series.setdefault(result['series'], []).append((result['size'], result['seconds']))
+	for name, values in series.items():
+		if len(values) < 2:
+			continue
+		sizes, seconds = np.log(np.array(sorted(values))).T
+		print('%-45s n^%.2f' % (name, np.polyfit(sizes, seconds, 1)[0]))
+
+def compare(results, baseline, tolerance, min_seconds = 0.005):
+	"""Returns a list of regressions against the baseline, time differences below min_seconds are noise"""
+	failures = []
+	for key, result in results.items():
+		if key not in baseline:
+			continue
+		reference = baseline[key]
+		slower = result['seconds'] - reference['seconds']
+		if slower > reference['seconds'] * tolerance and slower > min_seconds:
+			failures.append('%s: %.4f s, baseline %.4f s' % (key, result['seconds'], reference['seconds']))
+		if result['peak_bytes'] > reference['peak_bytes'] * (1 + tolerance):
+			failures.append('%s: %d bytes, baseline %d bytes' % (key, result['peak_bytes'], reference['peak_bytes']))
+		if not math.isclose(result['checksum'], reference['checksum'], rel_tol = 1e-9):
+			failures.append('%s: checksum %r, baseline %r' % (key, result['checksum'], reference['checksum']))
+	return failures
+
+def main(argv = None):
+	parser = argparse.ArgumentParser(description = 'Benchmarks for the tree computation')
+	parser.add_argument('--quick', action = 'store_true', help = 'only run the smallest sizes')
+	parser.add_argument('--repeat', type = int, default = 3, help = 'runs per case, the best time counts')
+	parser.add_argument('--baseline', default = BASELINE_PATH, help = 'baseline file')
+	parser.add_argument('--save-baseline', action = 'store_true', help = 'store the results as new baseline')
+	parser.add_argument('--tolerance', type = float, default = 0.5, help = 'allowed relative regression')
+	parser.add_argument('--min-seconds', type = float, default = 0.005, help = 'ignore slowdowns below this many seconds')
+	parser.add_argument('--output', help = 'also write the results as json to this file')
+	args = parser.parse_args(argv)
+
+	results = run(QUICK_SIZES if args.quick else SIZES, args.repeat)
+	report_scaling(results)
+
+	if args.output:
+		with open(args.output, 'w') as f:
+			json.dump(results, f, indent = 1)
+
+	if args.save_baseline:
+		with open(args.baseline, 'w') as f:
+			json.dump(results, f, indent = 1, sort_keys = True)
+		print('\nBaseline saved to %s' % args.baseline)
+		return 0
+
+	if not os.path.exists(args.baseline):
+		print('\nNo baseline at %s, run with --save-baseline first' % args.baseline)
+		return 1
+
+	with open(args.baseline) as f:
+		failures = compare(results, json.load(f), args.tolerance, args.min_seconds)
+	if failures:
+		print('\nRegressions:')
+		for failure in failures:
+			print('  ' + failure)
+		return 1
+	print('\nNo regressions')
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
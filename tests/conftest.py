@@ -0,0 +1,12 @@
+"""Helpers shared by the tests, import them with from conftest import ..."""
+import numpy as np
+
+from mst_blender import mstree
+
+def make_points(count, dimensions = 3, seed = 0):
+	"""Returns count random points in the unit cube, the same for the same seed"""
+	return np.random.default_rng(seed).random((count, dimensions))
+
+def make_tree(count = 300, seed = 0, balancing_factor = 0.5, compact = True):
+	"""Returns the tree of make_points(count, seed = seed)"""
+	return mstree.mstree(make_points(count, seed = seed), balancing_factor, compact = compact)
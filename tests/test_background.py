@@ -0,0 +1,69 @@
+import threading
+
+import numpy as np
+import pytest
+
+from mst_blender import mstree
+from mst_blender import background
+
+def test_progress_callback():
+	reports = []
+	points = np.random.default_rng(0).random((3000, 3))
+	for engine in ('exhaustive', 'grid'):
+		reports.clear()
+		mstree.mstree(points, 0.5, engine = engine, progress = lambda done, total: reports.append((done, total)))
+		assert reports[0] == (mstree.PROGRESS_INTERVAL, 3000)
+		assert reports[-1] == (3000, 3000)
+
+	reports.clear()
+	mstree.mstree_batch([points[:100], points[:10]], 0.5, max_elements = 100, progress = lambda done, total: reports.append((done, total)))
+	assert reports == [(100, 110), (110, 110)]
+
+def test_batch_progress_counts_points():
+	# A single stack of many small clouds reports while it runs
+	point_clouds = [np.random.default_rng(i).random((50, 3)) for i in range(100)]
+	reports = []
+	mstree.mstree_batch(point_clouds, 0.5, progress = lambda done, total: reports.append((done, total)))
+	assert len(reports) > 2
+	assert [done for done, total in reports] == sorted(done for done, total in reports)
+	assert reports[-1] == (5000, 5000)
+
+	reports.clear()
+	trees = mstree.mstree_batch(point_clouds, 0.5, compact = True, processes = 2, progress = lambda done, total: reports.append((done, total)))
+	assert reports[-1] == (5000, 5000)
+	assert all(np.array_equal(tree.parents, mstree.mstree(points, 0.5, compact = True).parents) for tree, points in zip(trees, point_clouds))
+
+def test_batch_cancel_in_pool():
+	def cancel(done, total):
+		raise background.Cancelled()
+
+	point_clouds = [np.random.default_rng(i).random((50, 3)) for i in range(20)]
+	with pytest.raises(background.Cancelled):
+		mstree.mstree_batch(point_clouds, 0.5, processes = 2, progress = cancel)
+
+def test_background_task():
+	points = np.random.default_rng(0).random((2000, 3))
+	task = background.BackgroundTask(mstree.mstree, points, 0.5, compact = True).start()
+	tree = task.result(timeout = 60)
+	assert task.done and task.progress == (2000, 2000)
+	assert np.array_equal(tree.parents, mstree.mstree(points, 0.5, compact = True).parents)
+
+def test_background_task_cancel():
+	started = threading.Event()
+	def work(progress):
+		started.set()
+		while True:
+			progress(0, 1)
+
+	task = background.BackgroundTask(work).start()
+	started.wait(10)
+	task.cancel()
+	with pytest.raises(background.Cancelled):
+		task.result(timeout = 10)
+
+def test_background_task_error():
+	def work(progress):
+		raise ValueError("bad points")
+
+	with pytest.raises(ValueError):
+		background.BackgroundTask(work).start().result(timeout = 10)
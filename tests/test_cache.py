@@ -0,0 +1,26 @@
+import numpy as np
+
+from mst_blender import mstree
+from mst_blender import cache
+from conftest import make_points
+
+def test_cached_tree_is_reused_without_thickness():
+	tree_cache = cache.TreeCache()
+	points = make_points(100)
+	tree = tree_cache.get_or_build(points, 0.5)
+	tree.thickness = np.ones(len(tree))
+	cached = tree_cache.get_or_build(points, 0.5)
+	assert cached.parents is tree.parents
+	assert cached.thickness is None
+	assert tree_cache.get(cache.tree_key(points, 0.3)) is None
+
+def test_eviction_and_disk_tier(tmp_path):
+	first = mstree.mstree(make_points(100, seed = 1), compact = True)
+	size = sum(array.nbytes for array in first.to_arrays().values())
+	tree_cache = cache.TreeCache(max_bytes = size, directory = str(tmp_path))
+	tree_cache.put('first', first)
+	tree_cache.put('second', mstree.mstree(make_points(100, seed = 2), compact = True))
+	assert len(tree_cache) == 1
+	loaded = tree_cache.get('first')
+	assert np.array_equal(loaded.parents, first.parents)
+	assert np.array_equal(loaded.dfs_order, first.dfs_order)
@@ -0,0 +1,28 @@
+import json
+import os
+import shutil
+
+import numpy as np
+
+from mst_blender import cli
+from mst_blender import treeio
+
+def test_cli(tmp_path):
+	input_directory = tmp_path / 'points'
+	input_directory.mkdir()
+	shutil.copy(os.path.join(os.path.dirname(__file__), 'testdata.csv'), input_directory)
+	np.save(input_directory / 'random.npy', np.random.default_rng(0).random((50, 3)))
+	(input_directory / 'notes.md').write_text('not a point cloud')
+
+	arguments = [str(input_directory), str(tmp_path / 'trees'), '--format', 'swc', 'npz', '--processes', '1', '--stats', str(tmp_path / 'stats.json')]
+	assert cli.main(arguments) == 0
+	assert sorted(os.listdir(tmp_path / 'trees')) == ['random.npz', 'random.swc', 'testdata.npz', 'testdata.swc']
+	tree = treeio.load_tree(str(tmp_path / 'trees' / 'testdata.npz'))
+	assert len(tree) == 101 and tree.thickness is not None
+	with open(tmp_path / 'stats.json') as f:
+		stats = json.load(f)
+	assert stats['totals']['mstree']['calls'] == 2
+	assert stats['totals']['load']['points'] == 151
+
+def test_cli_empty(tmp_path):
+	assert cli.main([str(tmp_path), str(tmp_path / 'trees')]) == 1
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from mst_blender import incremental
+from conftest import make_points, make_tree
+
+def assert_consistent(tree):
+	assert sorted(tree.dfs_order.tolist()) == list(range(len(tree)))
+	for index in tree.dfs_order[1:]:
+		parent = tree.parents[index]
+		expected = tree.path_distances[parent] + np.linalg.norm(tree.positions[index] - tree.positions[parent])
+		assert tree.path_distances[index] == pytest.approx(expected)
+
+def assert_changes_covered(tree, changed, differs):
+	"""Asserts that every node flagged in differs has itself or an ancestor in changed"""
+	changed = set(changed.tolist())
+	for index in np.flatnonzero(differs):
+		node = index
+		while node >= 0 and node not in changed:
+			node = tree.parents[node]
+		assert node >= 0, "node %d changed outside of the changed subtrees" % index
+
+def test_insert_points():
+	tree = make_tree(500)
+	new_points = make_points(4, seed = 1)
+	for point in new_points:
+		length = len(tree)
+		new_tree, changed = incremental.insert_points(tree, point, 0.5)
+		assert_consistent(new_tree)
+		assert np.array_equal(new_tree.positions[length], point)
+
+		# The new point is attached to the node with the lowest weighted distance
+		weighted_distance = np.linalg.norm(tree.positions - point, axis = 1) + 0.5 * tree.path_distances
+		parent = new_tree.parents[length]
+		assert np.linalg.norm(point - tree.positions[parent]) + 0.5 * tree.path_distances[parent] == pytest.approx(weighted_distance.min())
+
+		differs = np.ones(len(new_tree), dtype = bool)
+		differs[:length] = (new_tree.parents[:length] != tree.parents) | (new_tree.path_distances[:length] != tree.path_distances)
+		assert_changes_covered(new_tree, changed, differs)
+		tree = new_tree
+
+	# Inserting all points at once gives the same tree
+	batch_tree = incremental.insert_points(make_tree(500), new_points, 0.5)[0]
+	assert np.array_equal(batch_tree.parents, tree.parents)
+
+def test_remove_points():
+	tree = make_tree(500)
+	branch = int(np.argmax(np.diff(tree.child_offsets)))
+	removed = [branch, 7, 123] if branch != 0 else [7, 123]
+	new_tree, changed, index_map = incremental.remove_points(tree, removed, 0.5)
+	assert_consistent(new_tree)
+	assert len(new_tree) == 500 - len(removed)
+	assert np.all(index_map[removed] == -1)
+	kept = np.flatnonzero(index_map >= 0)
+	assert np.array_equal(new_tree.positions[index_map[kept]], tree.positions[kept])
+
+	# A removed parent maps to -1, so the orphans always count as changed
+	old_parents = np.where(tree.parents[kept] >= 0, index_map[tree.parents[kept]], -1)
+	differs = np.zeros(len(new_tree), dtype = bool)
+	differs[index_map[kept]] = (new_tree.parents[index_map[kept]] != old_parents) | (new_tree.path_distances[index_map[kept]] != tree.path_distances[kept])
+	assert differs.any()
+	assert_changes_covered(new_tree, changed, differs)
+
+def test_root_can_not_be_removed():
+	with pytest.raises(ValueError):
+		incremental.remove_points(make_tree(50), [0])
@@ -0,0 +1,69 @@
+import math
+
+import numpy as np
+import pytest
+
+from mst_blender import mstree
+from mst_blender import morphometrics
+from conftest import make_tree
+
+def node_strahler(node):
+	if not node.children:
+		return 1
+	orders = [node_strahler(child) for child in node.children]
+	highest = max(orders)
+	return highest + 1 if len(orders) > 1 and orders.count(highest) > 1 else highest
+
+def node_statistics(root_node):
+	nodes = mstree.tree_to_list(root_node)
+	path_length = {}
+	centrifugal = {}
+	for node in nodes:
+		if node.parent is None:
+			path_length[node.index] = 0.0
+			centrifugal[node.index] = 0
+		else:
+			path_length[node.index] = path_length[node.parent.index] + np.linalg.norm(node.pos - node.parent.pos)
+			centrifugal[node.index] = centrifugal[node.parent.index] + (len(node.parent.children) > 1)
+	segment_lengths = []
+	for node in nodes:
+		if node.parent is not None and len(node.children) != 1:
+			start = node.parent
+			while start.parent is not None and len(start.children) == 1:
+				start = start.parent
+			segment_lengths.append(path_length[node.index] - path_length[start.index])
+	return path_length, centrifugal, segment_lengths
+
+def test_statistics_match_node_walk():
+	root_node = make_tree(balancing_factor = 0.3, compact = False)
+	tree = mstree.ArrayTree.from_nodes(root_node)
+	path_length, centrifugal, segment_lengths = node_statistics(root_node)
+	nodes = mstree.tree_to_list(root_node)
+
+	assert np.allclose(morphometrics.path_lengths(tree), [path_length[i] for i in range(len(tree))])
+	assert morphometrics.centrifugal_order(tree).tolist() == [centrifugal[i] for i in range(len(tree))]
+	strahler = morphometrics.strahler_order(tree)
+	assert all(strahler[node.index] == node_strahler(node) for node in nodes)
+	assert np.allclose(np.sort(morphometrics.segment_lengths(tree)), np.sort(segment_lengths))
+
+	statistics = morphometrics.morphometrics(root_node)
+	assert statistics['tips'] == sum(1 for node in nodes if not node.children)
+	assert statistics['branch_points'] == sum(1 for node in nodes if len(node.children) > 1)
+	assert statistics['cable_length'] == pytest.approx(sum(np.linalg.norm(node.pos - node.parent.pos) for node in nodes[1:]))
+	assert statistics['cable_length'] == pytest.approx(np.sum(statistics['segment_lengths']))
+	assert statistics['strahler_order'] == node_strahler(root_node)
+	assert len(statistics['branch_angles']) == sum(len(node.children) - 1 for node in nodes if len(node.children) > 1)
+
+def test_branch_angles():
+	points = np.array([[0, 0, 0], [1, 0, 0], [2, 0, 0], [1, 1, 0], [3, 0, 0], [1, 2, 0]], dtype = float)
+	tree = mstree.mstree(points, 0.0, compact = True)
+	assert tree.parents.tolist() == [-1, 0, 1, 1, 2, 3]
+	assert morphometrics.branch_angles(tree) == pytest.approx([math.pi / 2])
+	assert morphometrics.strahler_order(tree).tolist() == [2, 2, 1, 1, 1, 1]
+	assert morphometrics.segment_lengths(tree).tolist() == [1.0, 2.0, 2.0]
+
+def test_batch_morphometrics():
+	trees = [make_tree(50, seed, 0.3, compact = False) for seed in range(3)] + [mstree.mstree(np.zeros((1, 3)), compact = True)]
+	results = morphometrics.batch_morphometrics(trees, processes = 1)
+	assert [result['nodes'] for result in results] == [50, 50, 50, 1]
+	assert results[-1]['strahler_order'] == 1 and results[-1]['cable_length'] == 0
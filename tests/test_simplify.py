@@ -0,0 +1,48 @@
+import numpy as np
+
+from mst_blender import mstree
+from mst_blender import diameter
+from mst_blender import simplify
+from conftest import make_points
+
+def make_helix_tree(count = 300, seed = 0):
+	angle = np.linspace(0, 20, count)
+	points = np.c_[np.cos(angle), np.sin(angle), angle * 0.1] + (make_points(count, seed = seed) - 0.5) * 0.02
+	tree = mstree.mstree(points, 0.3, compact = True)
+	diameter.add_quad_diameter(tree)
+	return tree
+
+def nearest_kept(tree, keep, node, down = False):
+	while not keep[node]:
+		node = tree.children[tree.child_offsets[node]] if down else tree.parents[node]
+	return node
+
+def test_error_bounds():
+	tree = make_helix_tree()
+	simplified, indices = simplify.simplify_tree(tree, 0.05, 0.1)
+	keep = np.zeros(len(tree), dtype = bool)
+	keep[indices] = True
+	assert len(simplified) < len(tree) / 2
+	assert keep[0] and np.all(keep[np.diff(tree.child_offsets) != 1])
+
+	for node in np.flatnonzero(~keep):
+		a = nearest_kept(tree, keep, tree.parents[node])
+		b = nearest_kept(tree, keep, node, down = True)
+		direction = tree.positions[b] - tree.positions[a]
+		t = np.clip((tree.positions[node] - tree.positions[a]) @ direction / (direction @ direction), 0, 1)
+		assert np.linalg.norm(tree.positions[a] + t * direction - tree.positions[node]) <= 0.05
+		assert abs(tree.thickness[a] + t * (tree.thickness[b] - tree.thickness[a]) - tree.thickness[node]) <= 0.1
+
+	for new, old in enumerate(indices[1:], 1):
+		assert indices[simplified.parents[new]] == nearest_kept(tree, keep, tree.parents[old])
+	assert np.array_equal(indices[simplified.dfs_order], tree.dfs_order[keep[tree.dfs_order]])
+	assert np.array_equal(simplified.thickness, tree.thickness[indices])
+
+def test_lod_levels():
+	tree = make_helix_tree()
+	levels = simplify.lod_levels(tree.to_nodes(), [0.0, 0.01, 0.1, 1.0])
+	assert len(levels[0]) == len(tree)
+	assert [len(level) for level in levels] == sorted((len(level) for level in levels), reverse = True)
+	key_nodes = np.count_nonzero(np.diff(tree.child_offsets) != 1)
+	assert len(levels[-1]) >= key_nodes
+	assert len(simplify.simplify_tree(tree, 100.0)[0]) == key_nodes + (np.diff(tree.child_offsets)[0] == 1)
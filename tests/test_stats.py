@@ -0,0 +1,34 @@
+import json
+
+import numpy as np
+import pytest
+
+from mst_blender.stats import StageStats
+
+def test_stage_totals():
+	stats = StageStats()
+	for count in (10, 20):
+		with stats.stage('mstree', points = count) as record:
+			record['nodes'] = count
+	with stats.stage('diameter'):
+		pass
+	totals = stats.totals()
+	assert list(totals) == ['mstree', 'diameter']
+	assert totals['mstree']['calls'] == 2
+	assert totals['mstree']['points'] == 30 and totals['mstree']['nodes'] == 30
+	assert totals['mstree']['seconds'] >= 0
+	assert 'mstree 0.' in stats.summary() and '(2x)' in stats.summary()
+	assert json.loads(stats.to_json())['records'][0] == stats.records[0]
+
+def test_stage_records_failures():
+	stats = StageStats()
+	with pytest.raises(ValueError):
+		with stats.stage('build'):
+			raise ValueError
+	assert stats.records[0]['stage'] == 'build'
+
+def test_peak_memory():
+	stats = StageStats(trace_memory = True)
+	with stats.stage('allocate'):
+		np.ones(2**20)
+	assert stats.records[0]['peak_memory'] >= 8 * 2**20
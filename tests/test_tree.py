@@ -1,19 +1,140 @@
-import mstree
-import numpy as np
-import cProfile
 import csv
-import time
-
-f = open('testdata_large.csv', 'r')
-reader = csv.reader(f, delimiter=";", quoting=csv.QUOTE_NONNUMERIC)
-points = np.array([row for row in reader])
-v = [1000, 2000, 3000, 4000, 5000, 6000, 7000, 8000, 9000, 10000]
-for vv in v:
-	points = np.random.rand(vv,2) * 10 - 5
-	points[0] = (0,0)
-	# cProfile.run('mstree.mstree(points, threshold = 100, balancing_factor = 0.0)')
-	t1 = time.time()
-	tree = mstree.mstree(points, balancing_factor = 0.0)
-	t2 = time.time()
-	print(vv, '\t', t2-t1)
-# mstree.add_quad_diameter(tree)
\ No newline at end of file
+import os
+
+import numpy as np
+import pytest
+
+from mst_blender import mstree
+from mst_blender import diameter
+from mst_blender import traversal
+from conftest import make_points
+
+def load_testdata():
+	with open(os.path.join(os.path.dirname(__file__), 'testdata.csv'), 'r') as f:
+		reader = csv.reader(f, delimiter=";", quoting=csv.QUOTE_NONNUMERIC)
+		return np.array([row for row in reader])
+
+def tree_signature(root_node):
+	return [(node.index, node.parent.index if node.parent else -1, node.path_distance) for node in mstree.tree_to_list(root_node)]
+
+@pytest.mark.parametrize('dimensions', [2, 3])
+@pytest.mark.parametrize('balancing_factor', [0.0, 0.5, 1.0])
+def test_engines_build_same_tree(dimensions, balancing_factor):
+	points = make_points(300, dimensions)
+	exhaustive = mstree.mstree(points, balancing_factor)
+	grid = mstree.mstree(points, balancing_factor, engine = 'grid')
+	assert tree_signature(exhaustive) == tree_signature(grid)
+
+def test_engines_break_ties_alike():
+	grid_points = np.stack(np.meshgrid(np.arange(10), np.arange(10), [0]), -1).reshape(-1, 3).astype(float)
+	for balancing_factor in (0.0, 0.3):
+		exhaustive = mstree.mstree(grid_points, balancing_factor)
+		grid = mstree.mstree(grid_points, balancing_factor, engine = 'grid')
+		assert tree_signature(exhaustive) == tree_signature(grid)
+
+@pytest.mark.parametrize('balancing_factor', [0.0, 0.5])
+def test_engines_build_same_clustered_tree(balancing_factor):
+	# Enough cells for several blocks per axis, with empty space between clusters
+	rng = np.random.default_rng(2)
+	centers = rng.random((8, 3)) * 20
+	points = (centers[rng.integers(0, 8, 4000)] + rng.normal(size = (4000, 3))).round(1)
+	exhaustive = mstree.mstree(points, balancing_factor, compact = True)
+	grid = mstree.mstree(points, balancing_factor, engine = 'grid', compact = True)
+	assert np.array_equal(exhaustive.parents, grid.parents)
+	assert np.array_equal(exhaustive.path_distances, grid.path_distances)
+
+def test_engines_build_same_nearly_flat_tree():
+	# Jitter across the plane must not shrink the cells to single points
+	points = make_points(2000, seed = 3) + [1, 2, 3]
+	points[:, 2] = 3 + np.random.default_rng(4).normal(0, 1e-7, len(points))
+	exhaustive = mstree.mstree(points, 0.5, compact = True)
+	grid = mstree.mstree(points, 0.5, engine = 'grid', compact = True)
+	assert np.array_equal(exhaustive.parents, grid.parents)
+	assert np.array_equal(exhaustive.path_distances, grid.path_distances)
+
+def test_batch_builds_same_trees():
+	rng = np.random.default_rng(1)
+	point_clouds = [make_points(int(count), 3, seed) for seed, count in enumerate(rng.integers(1, 150, 20))]
+	balancing_factors = rng.random(len(point_clouds))
+	trees = mstree.mstree_batch(point_clouds, balancing_factors, compact = True, max_elements = 1000)
+	for points, balancing_factor, tree in zip(point_clouds, balancing_factors, trees):
+		expected = mstree.mstree(points, balancing_factor, compact = True)
+		assert np.array_equal(tree.parents, expected.parents)
+		assert np.array_equal(tree.path_distances, expected.path_distances)
+
+@pytest.mark.parametrize('max_bytes', [2**30, 1000])
+def test_sweep_builds_same_trees(max_bytes):
+	points = make_points(200, 3)
+	balancing_factors = [0.0, 0.25, 0.5, 1.0]
+	trees = mstree.mstree_sweep(points, balancing_factors, compact = True, max_bytes = max_bytes, threads = 2)
+	for balancing_factor, tree in zip(balancing_factors, trees):
+		expected = mstree.mstree(points, balancing_factor, compact = True)
+		assert np.array_equal(tree.parents, expected.parents)
+		assert np.array_equal(tree.path_distances, expected.path_distances)
+
+def test_testdata_tree():
+	points = load_testdata()
+	nodes = mstree.tree_to_list(mstree.mstree(points, 0.5))
+	assert sorted(node.index for node in nodes) == list(range(len(points)))
+	for node in nodes[1:]:
+		assert node.path_distance == pytest.approx(node.parent.path_distance + np.linalg.norm(node.pos - node.parent.pos))
+
+@pytest.mark.parametrize('count', [1, 2, 50, 1000])
+def test_partitioned_tree(count):
+	points = make_points(count, 3)
+	tree = mstree.mstree_partitioned(points, 0.5, compact = True, points_per_partition = 64)
+	assert tree.parents[0] == -1 and np.all(tree.parents[1:] >= 0)
+	assert sorted(tree.dfs_order.tolist()) == list(range(count))
+	non_root = np.arange(1, count)
+	assert np.allclose(tree.path_distances[non_root], tree.path_distances[tree.parents[non_root]] + np.linalg.norm(points[non_root] - points[tree.parents[non_root]], axis = 1))
+
+def test_partition_quality():
+	quality = mstree.partition_quality(make_points(3000, 3), 0.5, sample_size = 1000, points_per_partition = 300)
+	assert set(quality['exact']) == set(quality['approximate']) == {'total_length', 'mean_path_distance'}
+	assert 0.9 < quality['total_length_ratio'] < 1.5
+
+def test_compact_tree_matches_nodes():
+	points = make_points(200, 3)
+	root_node = mstree.mstree(points, 0.5)
+	tree = mstree.mstree(points, 0.5, compact = True)
+	assert [node.index for node in mstree.tree_to_list(root_node)] == tree.dfs_order.tolist()
+	assert tree_signature(tree.to_nodes()) == tree_signature(root_node)
+	assert tree_signature(mstree.ArrayTree.from_nodes(root_node).to_nodes()) == tree_signature(root_node)
+
+def test_paths():
+	tree = mstree.mstree(make_points(200, 3), 0.5, compact = True)
+	nodes, boundaries = tree.paths()
+	tips = tree.terminals()
+	assert len(boundaries) == len(tips) + 1
+	for start, end in zip(boundaries[:-1], boundaries[1:]):
+		path = nodes[start:end]
+		assert np.array_equal(tree.parents[path[1:]], path[:-1])
+		assert path[-1] in tips
+	assert sorted(set(nodes.tolist())) == list(range(len(tree)))
+
+def test_float32_tree():
+	tree = mstree.mstree(make_points(200, 3), 0.5, compact = True, dtype = np.float32)
+	assert tree.positions.dtype == np.float32
+	assert np.all(tree.parents[1:] >= 0)
+
+def test_long_chain_traversal():
+	chain = np.zeros((5000, 3))
+	chain[:, 0] = np.arange(5000)
+	root_node = mstree.mstree(chain, 0.0, engine = 'grid')
+	nodes = mstree.tree_to_list(root_node)
+	assert [node.index for node in nodes] == list(range(5000))
+	assert traversal.post_order(root_node) == nodes[::-1]
+
+def test_quad_diameter_nodes_and_arrays():
+	points = make_points(300, 3)
+	root_node = mstree.mstree(points, 0.5)
+	tree = mstree.mstree(points, 0.5, compact = True)
+	diameter.add_quad_diameter(root_node, 1.0, 0.5, 100.0)
+	diameter.add_quad_diameter(tree, 1.0, 0.5, 100.0)
+	for node in mstree.tree_to_list(root_node):
+		assert node.thickness == pytest.approx(tree.thickness[node.index], rel = 1e-9)
+	# Tips only average their own thickness function
+	tip = tree.terminals()[0]
+	x = tree.path_distances[tip] * 100.0
+	c = diameter.quad_coefficients[min(diameter.quad_coefficients, key = lambda k: abs(k - x))]
+	assert tree.thickness[tip] == pytest.approx(x**2 * c[0] + x * c[1] + c[2] + 0.5)
@@ -0,0 +1,40 @@
+import os
+
+import numpy as np
+
+from mst_blender import mstree
+from mst_blender import diameter
+from mst_blender import treeio
+
+def test_load_points(tmp_path):
+	testdata = os.path.join(os.path.dirname(__file__), 'testdata.csv')
+	points = treeio.load_points(testdata)
+	with open(testdata, 'r') as f:
+		assert np.array_equal(points, [[float(value) for value in line.split(';')] for line in f])
+	np.save(tmp_path / 'points.npy', points)
+	mapped = treeio.load_points(str(tmp_path / 'points.npy'))
+	assert isinstance(mapped, np.memmap)
+	np.savez(tmp_path / 'points.npz', points = points, other = np.zeros(1))
+	assert np.array_equal(treeio.load_points(str(tmp_path / 'points.npz')), points)
+
+def test_write_swc(tmp_path):
+	points = np.random.default_rng(0).random((50, 3))
+	tree = mstree.mstree(points, 0.5, compact = True)
+	diameter.add_quad_diameter(tree, 1.0, 0.5, 100.0)
+	treeio.write_swc(str(tmp_path / 'tree.swc'), tree, path_scale = 100.0)
+	table = np.loadtxt(tmp_path / 'tree.swc')
+	assert table.shape == (50, 7)
+	assert table[0, 6] == -1
+	assert np.all(table[1:, 6] < table[1:, 0])
+	assert np.allclose(table[:, 2:5], points[tree.dfs_order])
+	assert np.allclose(table[:, 5], tree.thickness[tree.dfs_order] / 200)
+	# Radii in the units of the coordinates, the root is much thinner than the tree
+	assert table[0, 5] < 0.1
+
+def test_save_and_load_tree(tmp_path):
+	tree = mstree.mstree(np.random.default_rng(1).random((50, 2)), 0.5, compact = True)
+	treeio.save_tree(str(tmp_path / 'tree.npz'), tree)
+	loaded = treeio.load_tree(str(tmp_path / 'tree.npz'))
+	for name, array in tree.to_arrays().items():
+		assert np.array_equal(getattr(loaded, name), array)
+	assert loaded.thickness is None
@@ -0,0 +1,53 @@
+import numpy as np
+
+from mst_blender import mstree
+from mst_blender import diameter
+from mst_blender import tubemesh
+
+def polygons(starts, totals, loops):
+	return [loops[start:start + total] for start, total in zip(starts, totals)]
+
+def test_tube_of_chain():
+	chain = np.zeros((5, 3))
+	chain[:, 0] = np.arange(5)
+	tree = mstree.mstree(chain, 0.5, compact = True)
+	vertices, starts, totals, loops = tubemesh.tube_mesh(tree, resolution = 6, radius = 0.5)
+	assert vertices.shape == (30, 3)
+	assert totals.tolist() == [4] * 24 + [6, 6]
+	assert np.allclose(np.linalg.norm(vertices[:, 1:], axis = 1), 0.5)
+
+	# Quads face away from the axis and don't twist
+	for polygon in polygons(starts, totals, loops)[:24]:
+		corners = vertices[polygon]
+		normal = np.cross(corners[1] - corners[0], corners[3] - corners[0])
+		center = corners.mean(axis = 0)
+		assert np.dot(normal[1:], center[1:]) > 0
+		assert np.isclose(abs(corners[3, 0] - corners[0, 0]), 1.0)
+		assert np.allclose(corners[3, 1:], corners[0, 1:])
+
+def test_tube_of_tree():
+	points = np.random.default_rng(0).random((200, 3))
+	tree = mstree.mstree(points, 0.5, compact = True)
+	diameter.add_quad_diameter(tree)
+	vertices, starts, totals, loops = tubemesh.tube_mesh(tree, resolution = 8, radius = 0.005)
+	tips = len(tree.terminals())
+	paths = tips
+	rings = len(tree) + paths - 1
+	assert len(vertices) == rings * 8
+	assert len(totals) == (rings - paths) * 8 + tips + 1
+	assert starts[-1] + totals[-1] == len(loops)
+	assert loops.min() == 0 and loops.max() == len(vertices) - 1
+
+	# Every quad joins vertices that are less than one ring step apart in angle,
+	# unless the path bends sharply between the rings
+	ring_offsets = vertices.reshape(-1, 8, 3) - vertices.reshape(-1, 8, 3).mean(axis = 1, keepdims = True)
+	quads = np.array([polygon for polygon in polygons(starts, totals, loops) if len(polygon) == 4])
+	a = ring_offsets[quads[:, 0] // 8, quads[:, 0] % 8]
+	b = ring_offsets[quads[:, 3] // 8, quads[:, 3] % 8]
+	cosine = np.sum(a * b, axis = 1) / (np.linalg.norm(a, axis = 1) * np.linalg.norm(b, axis = 1))
+	assert np.median(cosine) > np.cos(np.pi / 8)
+
+def test_single_node():
+	tree = mstree.mstree(np.zeros((1, 3)), compact = True)
+	vertices, starts, totals, loops = tubemesh.tube_mesh(tree)
+	assert len(vertices) == 8 and totals.tolist() == [8]